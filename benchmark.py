@@ -0,0 +1,354 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Synthetic data generator and stage benchmarks for the DiffEngine class in the extract.py module
+
+Generates pipe-delimited .dat files laid out as HEADERS and a .seed file laid out as t_desc|tag_name|counter_party|avg,
+then times each stage of the engine on its own:
+    rank_files, parse (iter_xsv_rows), prefilter (prefilter_rows), pick (regex checks + pick_or_reject_narrative),
+    write (write_pipe_delimited) and the whole run (get_files)
+and compares the projecting row parser (row_parser.py) with a full split-and-strip of every field, on the generated
+rows and on the same rows made wide with extra unused columns (--wide)
+
+Results are written as JSON and compared against a stored baseline; a stage slower than the baseline by more than
+the tolerance is reported as a regression and the script exits with status 1. Timings only compare on the machine
+they were taken on, so no baseline is shipped: save one with --save-baseline first. Without a baseline, or with one
+run on a different config, nothing can be compared and the script exits with status 2.
+
+Run from the DiffEngine folder so the loggers can find the logs directory, eg:
+    python benchmark.py --files 10 --rows 20000 --baseline bench/baseline.json --save-baseline
+    python benchmark.py --files 10 --rows 20000 --baseline bench/baseline.json
+"""
+
+import os
+import re
+import gc
+import sys
+import json
+import time
+import random
+import string
+import shutil
+import platform
+import tempfile
+
+from extract import DiffEngine, HEADERS, OUT_HEADERS, pos_TRANS_NARR, li_idx_parsed, current_path
+from row_parser import RowParser
+from regex_filters import re_bad_narratives, re_dead_narratives
+
+SEED_HEADS = "t_desc|tag_name|counter_party|avg"
+
+# words that show up in most narratives, on top of the generated vocabulary
+COMMON_WORDS = ['PAYMENT', 'TO', 'FROM', 'CARD', 'DD', 'BGC', 'SO', 'TFR', 'REF', 'LTD', 'PLC', 'UK', 'ONLINE', 'BANK']
+
+
+def make_vocabulary(size, rnd):
+    vocab = set()
+    while len(vocab) < size:
+        vocab.add(''.join(rnd.choice(string.ascii_uppercase) for _ in xrange(rnd.randint(3, 10))))
+
+    return COMMON_WORDS + sorted(vocab)
+
+
+def make_narrative(vocab, rnd):
+    tokens = [rnd.choice(vocab) for _ in xrange(rnd.randint(1, 6))]
+
+    # reference numbers and dates which the regex filters are there to catch
+    if rnd.random() < 0.2:
+        tokens.append(str(rnd.randint(100, 99999999)))
+    if rnd.random() < 0.1:
+        tokens.append('%02d%s' % (rnd.randint(1, 28), rnd.choice(['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN'])))
+
+    return ' '.join(tokens)
+
+
+class NarrativeSource(object):
+    """
+    hands out narratives, re-using an earlier one with probability dup_ratio
+    """
+    def __init__(self, vocab, dup_ratio, rnd, pool_size=10000):
+        self.vocab = vocab
+        self.dup_ratio = dup_ratio
+        self.rnd = rnd
+        self.pool_size = pool_size
+        self.pool = []
+
+    def next(self):
+        if self.pool and self.rnd.random() < self.dup_ratio:
+            return self.rnd.choice(self.pool)
+
+        narrative = make_narrative(self.vocab, self.rnd)
+        if len(self.pool) < self.pool_size:
+            self.pool.append(narrative)
+        else:
+            self.pool[self.rnd.randrange(self.pool_size)] = narrative
+
+        return narrative
+
+
+def make_row(narratives, rnd):
+    fields = {'entry_date': '%s/%02d/%02d' % (rnd.choice([2009, 2010, 2011, 2012, 2013, 2014, 2015, 2016]),
+                                              rnd.randint(1, 12), rnd.randint(1, 28)),
+              'TRANS_TYPE': rnd.choice(['DEB', 'CRE', 'DD', 'SO']),
+              'COMPARISON_FIELD': narratives.next() if rnd.random() > 0.03 else '',
+              'SYS_ID': str(rnd.randint(1, 999999)),
+              'GEN_DATE': '2015/%02d/%02d' % (rnd.randint(1, 12), rnd.randint(1, 28)),
+              'TRANS_system': 'SYS%s' % rnd.randint(1, 5),
+              'TRANS_amount': rnd.choice(['-%s.%02d' % (rnd.randint(0, 5000), rnd.randint(0, 99)),
+                                          '%s.%02d' % (rnd.randint(0, 5000), rnd.randint(0, 99)),
+                                          '-%s' % rnd.randint(1, 500), 'n/a']),
+              'acc_bal': '%s.%02d' % (rnd.randint(-5000, 50000), rnd.randint(0, 99)),
+              '_NAME_': rnd.choice(narratives.vocab)}
+
+    row = [fields.get(h, '') for h in HEADERS]
+
+    if rnd.random() < 0.01:
+        row = row[:rnd.randint(1, len(row) - 1)]  # misaligned row
+
+    return '|'.join(row)
+
+
+def generate_data(data_dir, files=5, rows=10000, seed_rows=2000, vocab_size=5000, dup_ratio=0.3, random_seed=0):
+    """
+    writes files x rows .dat files and a seed_rows .seed file to data_dir
+
+    returns:
+        (glob of the .dat files, path of the .seed file)
+    """
+    rnd = random.Random(random_seed)
+    vocab = make_vocabulary(vocab_size, rnd)
+    narratives = NarrativeSource(vocab, dup_ratio, rnd)
+
+    with open(os.path.join(data_dir, 'bench.seed'), 'w') as fileHandle:
+        fileHandle.write(SEED_HEADS + '\n')
+        for i in xrange(seed_rows):
+            fileHandle.write('%s|tag%s|%s|%s\n' % (narratives.next(), i % 50, rnd.choice(vocab), rnd.randint(1, 500)))
+
+    for f in xrange(files):
+        with open(os.path.join(data_dir, 'bench%03d.dat' % f), 'w') as fileHandle:
+            for _ in xrange(rows):
+                fileHandle.write(make_row(narratives, rnd) + '\n')
+
+    return os.path.join(data_dir, '*.dat'), os.path.join(data_dir, 'bench.seed')
+
+
+def timed(func):
+    """
+    returns (func(), seconds taken)
+    """
+    start = time.time()
+    value = func()
+
+    return value, time.time() - start
+
+
+def record(results, stage, seconds, rows):
+    results[stage] = {'seconds': round(seconds, 4), 'rows': rows,
+                      'rows_per_sec': round(rows / seconds, 1) if seconds else None}
+    print '%-10s %10.3fs %10s rows' % (stage, seconds, rows)
+
+
+def run_stages(data_dir, workers=1):
+    """
+    times each engine stage on the generated data in data_dir. each stage gets the output of the one before
+    """
+    kwargs = {'fileloc': data_dir, 'ext': '*.dat', 'outfile': os.path.join(data_dir, 'out', 'bench0.out'),
+              'seed_files': os.path.join(data_dir, '*.seed'), 'seed_snapshot': os.path.join(data_dir, 'seed.pkl'),
+              'workers': workers, 'rank_cache': False}
+    os.mkdir(os.path.join(data_dir, 'out'))
+    stages = {}
+
+    engine = DiffEngine(**kwargs)
+    dat_files = [r['dat_file'] for r in engine.ranked_files]
+
+    _, seconds = timed(engine.rank_files)
+    record(stages, 'rank_files', seconds, len(dat_files))
+
+    def parse():
+        return [list(engine.iter_xsv_rows(dat_file)) for dat_file in dat_files]
+    parsed, seconds = timed(parse)
+    total_rows = sum(len(rows) for rows in parsed)
+    record(stages, 'parse', seconds, total_rows)
+
+    def prefilter():
+        return [engine.prefilter_rows(rows) for rows in parsed]
+    survivors, seconds = timed(prefilter)
+    record(stages, 'prefilter', seconds, total_rows)
+
+    def pick():
+        accepted = []
+        for rows in survivors:
+            accepted.append([OUT_HEADERS])
+            for row_data in rows:
+                narr = re.sub(r'\s{2,}', ' ', row_data[pos_TRANS_NARR])
+                if re_bad_narratives.match(narr) or re_dead_narratives.match(narr):
+                    continue
+                if engine.pick_or_reject_narrative(narr):
+                    row_data[pos_TRANS_NARR] = narr
+                    accepted[-1].append(row_data[:len(OUT_HEADERS)])
+        return accepted
+    accepted, seconds = timed(pick)
+    record(stages, 'pick', seconds, sum(len(rows) for rows in survivors))
+
+    def write():
+        for c, rows in enumerate(accepted):
+            engine.write_pipe_delimited(os.path.join(data_dir, 'out', 'write%s.out' % c), rows, True)
+    _, seconds = timed(write)
+    record(stages, 'write', seconds, sum(len(rows) - 1 for rows in accepted))
+
+    def end_to_end():
+        DiffEngine(**kwargs).get_files()
+    _, seconds = timed(end_to_end)
+    record(stages, 'get_files', seconds, total_rows)
+
+    return stages
+
+
+def split_parse(lines, delimiter='|'):
+    """
+    the parser iter_xsv_rows used before row_parser.py: every field of every line split and stripped
+    """
+    for l in lines:
+        yield [x.strip() for x in l.replace('|?', '|').split(delimiter)]
+
+
+def widen(lines, columns, rnd):
+    """
+    lines with columns extra fields appended, as in an extract carrying many columns the engine does not use
+    """
+    extra = '|'.join('COL%s' % rnd.randint(0, 999999) for _ in xrange(columns))
+
+    return [l.rstrip('\n') + '|' + extra + '\n' for l in lines]
+
+
+def run_parser_comparison(data_dir, wide_columns, random_seed=0):
+    """
+    times split_parse against RowParser on the lines of the generated .dat files, and on the same lines with
+    wide_columns extra fields. both have to agree on every kept field
+    """
+    lines = []
+    for dat_file in sorted(os.listdir(data_dir)):
+        if dat_file.endswith('.dat'):
+            with open(os.path.join(data_dir, dat_file)) as fileHandle:
+                lines.extend(fileHandle)
+
+    row_parser = RowParser(len(HEADERS), li_idx_parsed)
+    stages = {}
+
+    inputs = [('', lines)]
+    if wide_columns:
+        inputs.append(('_wide', widen(lines, wide_columns, random.Random(random_seed))))
+
+    for suffix, stage_lines in inputs:
+        # the collector would otherwise keep rescanning the rows already parsed, and swamp the timings
+        gc.disable()
+        try:
+            split_rows, seconds = timed(lambda: list(split_parse(stage_lines)))
+            record(stages, 'parse_split' + suffix, seconds, len(stage_lines))
+
+            projected_rows, seconds = timed(lambda: list(row_parser.parse_lines(stage_lines)))
+            record(stages, 'parse_projected' + suffix, seconds, len(stage_lines))
+        finally:
+            gc.enable()
+
+        for split_row, projected_row in zip(split_rows, projected_rows):
+            expected = [split_row[i] for i in li_idx_parsed] if len(split_row) >= len(HEADERS) else []
+            assert projected_row == expected, (split_row, projected_row)
+
+    return stages
+
+
+def compare(results, baseline, tolerance):
+    """
+    returns a list of (stage, baseline seconds, seconds) for stages slower than baseline by more than tolerance
+    """
+    regressions = []
+    for stage, timing in sorted(results['stages'].items()):
+        base = baseline.get('stages', {}).get(stage)
+        if base is None:
+            continue
+        if timing['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append((stage, base['seconds'], timing['seconds']))
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='generate synthetic data and time each DiffEngine stage')
+
+    parser.add_argument('--files', type=int, default=5, help='number of .dat files; defaults to 5')
+    parser.add_argument('--rows', type=int, default=10000, help='rows per .dat file; defaults to 10000')
+    parser.add_argument('--seed-rows', dest='seed_rows', type=int, default=2000,
+                        help='rows in the .seed file; defaults to 2000')
+    parser.add_argument('--vocab', dest='vocab_size', type=int, default=5000,
+                        help='number of distinct generated words; defaults to 5000')
+    parser.add_argument('--dup-ratio', dest='dup_ratio', type=float, default=0.3,
+                        help='chance a narrative repeats an earlier one; defaults to 0.3')
+    parser.add_argument('--random-seed', dest='random_seed', type=int, default=0,
+                        help='seed for the data generator; defaults to 0')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='workers for rank_files; defaults to 1')
+    parser.add_argument('-o', '--output', default=os.path.join(current_path(), 'bench', 'results.json'),
+                        help='results file; defaults to bench/results.json')
+    parser.add_argument('-b', '--baseline', default=os.path.join(current_path(), 'bench', 'baseline.json'),
+                        help='baseline results to compare against; defaults to bench/baseline.json')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true',
+                        help='also write the results as the new baseline')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against the baseline before a stage counts as a regression; '
+                             'defaults to 0.25')
+    parser.add_argument('--wide', type=int, default=40,
+                        help='unused columns added to each row for the wide rows parser comparison; 0 to skip it; '
+                             'defaults to 40')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data directory')
+
+    args = parser.parse_args()
+
+    config = {'files': args.files, 'rows': args.rows, 'seed_rows': args.seed_rows, 'vocab_size': args.vocab_size,
+              'dup_ratio': args.dup_ratio, 'random_seed': args.random_seed, 'workers': args.workers,
+              'wide': args.wide}
+
+    data_dir = tempfile.mkdtemp(prefix='diffengine_bench_')
+    try:
+        print 'generating data in %s' % data_dir
+        generate_data(data_dir, args.files, args.rows, args.seed_rows, args.vocab_size, args.dup_ratio,
+                      args.random_seed)
+        stages = run_stages(data_dir, args.workers)
+        stages.update(run_parser_comparison(data_dir, args.wide, args.random_seed))
+    finally:
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    results = {'config': config, 'stages': stages, 'python': platform.python_version(),
+               'machine': platform.node(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    for path in [args.output] + ([args.baseline] if args.save_baseline else []):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fileHandle:
+            json.dump(results, fileHandle, indent=2, sort_keys=True)
+        print 'results written to %s' % path
+
+    if args.save_baseline:
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print >> sys.stderr, 'NO BASELINE at %s - nothing was compared. run with --save-baseline to create one' % (
+            args.baseline)
+        sys.exit(2)
+
+    with open(args.baseline) as fileHandle:
+        baseline = json.load(fileHandle)
+
+    if baseline.get('config') != config:
+        print >> sys.stderr, 'baseline was run with %s, not %s - timings are not comparable' % (
+            baseline.get('config'), config)
+        sys.exit(2)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for stage, base_seconds, seconds in regressions:
+        print 'REGRESSION %s: %.3fs against baseline %.3fs' % (stage, seconds, base_seconds)
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,57 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Checkpoints for long DiffEngine runs in the extract.py module
+
+Which rows get accepted depends on every row accepted before it, so a run can only be resumed from the exact
+engine state at a known position. A checkpoint pickles that state - seed densities, already checked narratives,
+counters, ranked files - with the position in the ranked files, the row reached in the current file and the
+size of the output file at that point.
+"""
+
+import os
+import cPickle
+
+from loggers import main_logger
+
+CHECKPOINT_FILENAME = 'diffengine.checkpoint'
+
+# bump this if the layout of the checkpoint changes
+CHECKPOINT_VERSION = 9
+
+
+def save_checkpoint(checkpoint_file, state):
+    """
+    pickles state to checkpoint_file. the previous checkpoint is only replaced once the new one is fully written
+    """
+    state = dict(state, version=CHECKPOINT_VERSION)
+
+    tmp_file = checkpoint_file + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as fileHandle:
+            cPickle.dump(state, fileHandle, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, checkpoint_file)
+    except (IOError, OSError) as e:
+        main_logger.error('could not write checkpoint %s: %s' % (checkpoint_file, e))
+        return False
+
+    return True
+
+
+def load_checkpoint(checkpoint_file):
+    """
+    returns the state saved in checkpoint_file, or None if there is no usable checkpoint
+    """
+    try:
+        with open(checkpoint_file, 'rb') as fileHandle:
+            state = cPickle.load(fileHandle)
+    except (IOError, EOFError, cPickle.UnpicklingError) as e:
+        main_logger.warning('no usable checkpoint at %s: %s' % (checkpoint_file, e))
+        return None
+
+    if state.get('version') != CHECKPOINT_VERSION:
+        main_logger.warning('checkpoint %s was written by a different version, ignoring it' % checkpoint_file)
+        return None
+
+    return state
+
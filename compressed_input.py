@@ -0,0 +1,192 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Reading compressed (.gz, .bz2, .xz) data files for the DiffEngine class in the extract.py module
+
+Compressed files are read as streams, so they never have to be decompressed to disk first. rank_files scores them
+in line-aligned blocks rather than through mmap, and a Prefetcher can decompress the next few files in the ranked
+order in worker processes while the engine is still consuming rows from the current one.
+
+.xz needs the lzma module (backports.lzma on python 2); without it the xz command line tool is used.
+"""
+
+import os
+import bz2
+import gzip
+import glob
+import subprocess
+import multiprocessing
+import cStringIO
+
+from loggers import main_logger
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+class _XzCommand(object):
+    # read-only file-like object over `xz -dc`, for when there is no lzma module
+    def __init__(self, path):
+        self.process = subprocess.Popen(['xz', '-dc', path], stdout=subprocess.PIPE)
+
+    def read(self, size=-1):
+        return self.process.stdout.read(size)
+
+    def __iter__(self):
+        return iter(self.process.stdout)
+
+    def close(self):
+        self.process.stdout.close()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _open_xz(path):
+    if lzma is not None:
+        return lzma.LZMAFile(path, 'rb')
+    return _XzCommand(path)
+
+
+# extension -> function opening the file for reading decompressed bytes
+COMPRESSED_EXTENSIONS = {'.gz': lambda path: gzip.open(path, 'rb'),
+                         '.bz2': lambda path: bz2.BZ2File(path, 'rb'),
+                         '.xz': _open_xz}
+
+# bytes of decompressed data per block
+BLOCK_SIZE = 1 << 20
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+def open_data_file(path):
+    """
+    opens a data file for reading, decompressing it on the fly if it has a compressed extension
+    """
+    opener = COMPRESSED_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if opener is None:
+        return open(path, 'r')
+
+    return opener(path)
+
+
+def glob_data_files(pattern):
+    """
+    files matching pattern, followed by compressed versions of matching files - eg for *.dat also *.dat.gz
+    """
+    files = glob.glob(pattern)
+    for ext in sorted(COMPRESSED_EXTENSIONS):
+        if not pattern.endswith(ext):
+            files.extend(glob.glob(pattern + ext))
+
+    # a pattern such as * or *.dat* matches the compressed files itself, so they are listed again - keep the first
+    seen = set()
+    return [f for f in files if not (f in seen or seen.add(f))]
+
+
+def iter_blocks(fileHandle, block_size=BLOCK_SIZE):
+    """
+    yields the contents of fileHandle in blocks of about block_size bytes, each ending on a line break
+    (apart from possibly the last) so no line is split between two blocks
+    """
+    tail = ''
+    while True:
+        data = fileHandle.read(block_size)
+        if not data:
+            break
+
+        data = tail + data
+        cut = data.rfind('\n') + 1
+        if cut == 0:
+            tail = data
+            continue
+
+        tail = data[cut:]
+        yield data[:cut]
+
+    if tail:
+        yield tail
+
+
+def _decompress_to_queue(path, queue, block_size):
+    # runs in a worker process: streams the decompressed blocks of path into queue, then None
+    try:
+        with open_data_file(path) as fileHandle:
+            for block in iter_blocks(fileHandle, block_size):
+                queue.put(block)
+    except Exception as e:
+        queue.put(('error', '%s: %s' % (path, e)))
+    queue.put(None)
+
+
+class Prefetcher(object):
+    """
+    decompresses up to `workers` of the compressed files ahead of the engine, each in its own process feeding a
+    bounded queue of blocks. files have to be read with lines() in the order they were given
+
+    args:
+        files(list): data files in the order they will be read; uncompressed ones are skipped
+        workers(int): number of files decompressed at the same time
+        queue_blocks(int): decompressed blocks buffered per file, which bounds memory at about
+                           workers x queue_blocks x block_size
+    """
+    def __init__(self, files, workers=2, queue_blocks=8, block_size=BLOCK_SIZE):
+        self.pending = [f for f in files if is_compressed(f)]
+        self.workers = workers
+        self.queue_blocks = queue_blocks
+        self.block_size = block_size
+        self.running = {}  # path -> (process, queue)
+        self._start_next()
+
+    def _start_next(self):
+        while self.pending and len(self.running) < self.workers:
+            path = self.pending.pop(0)
+            queue = multiprocessing.Queue(self.queue_blocks)
+            process = multiprocessing.Process(target=_decompress_to_queue, args=(path, queue, self.block_size))
+            process.daemon = True
+            process.start()
+            self.running[path] = (process, queue)
+
+    def __contains__(self, path):
+        return path in self.running
+
+    def lines(self, path):
+        """
+        yields the decompressed lines of path, as iterating over an open file would
+        """
+        process, queue = self.running[path]
+        try:
+            while True:
+                block = queue.get()
+                if block is None:
+                    break
+                if isinstance(block, tuple):
+                    raise IOError(block[1])
+
+                for line in cStringIO.StringIO(block):
+                    yield line
+        finally:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            del self.running[path]
+            self._start_next()
+
+    def close(self):
+        self.pending = []
+        for path, (process, queue) in self.running.items():
+            process.terminate()
+            process.join()
+        self.running = {}
+        main_logger.debug('prefetcher closed')
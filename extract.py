@@ -14,15 +14,44 @@ See class documentation for more information
 
 
 import os, mmap
+import time
+import logging
+import resource
 import glob
+import itertools
+import contextlib
+import multiprocessing
+import functools
 import shutil
+import tempfile
+import signal
 import re
 import csv
+import collections
 import numpy as np
 
 
-from loggers import ch, stream_logger, main_logger, iologger, classifier_logger, final_stats
+from loggers import ch, stream_logger, main_logger, iologger, classifier_logger, final_stats, trace_logger
+from loggers import start_async_logging, set_trace_sample_rate
 from regex_filters import *
+from seed_stats import SeedDensityStats
+from rank_cache import RankCache, pattern_signature, RANK_CACHE_FILENAME, MISSING
+from seed_snapshot import load_seed_snapshot, write_seed_snapshot, SEED_SNAPSHOT_FILENAME
+from token_cache import TokenClassCache, TOKEN_CACHE_SIZE
+from run_stats import RunStats, STAGES
+from checkpoint import save_checkpoint, load_checkpoint, CHECKPOINT_FILENAME
+from output_writer import OutputWriter, ROTATE_BYTES, WRITE_BUFFER_BYTES
+from near_duplicates import NearDuplicateIndex, NEAR_DUP_THRESHOLD, NEAR_DUP_BANDS, NEAR_DUP_ROWS, SHINGLE_SIZE
+from top_k import TopKHeap, TopKEntry, novelty_score
+from shards import ShardCoordinator, compare_accepted, SHARD_SYNC_ROWS
+from file_scorer import FileScorer, RANK_MODES
+from file_sampler import FileSampler, SAMPLE_BLOCKS, SAMPLE_BLOCK_BYTES
+from compressed_input import Prefetcher, open_data_file, glob_data_files, is_compressed, iter_blocks
+from token_ids import TokenDictionary, TokenDensities, SeedIndex
+from row_parser import RowParser
+from watcher import DirectoryWatcher, WATCH_POLL_SECONDS, WATCH_FLUSH_SECONDS
+from file_yield import YieldMonitor, YIELD_POLICIES, YIELD_FLOOR, YIELD_MIN_ROWS, YIELD_WINDOW, SETTLE_RATE
+from membership import new_membership_set, membership_nbytes, MEMBERSHIP_MODES, BLOOM_CAPACITY, BLOOM_ERROR_RATE
 
 
 # list of fields in the input data #todo - update this for your own data!
@@ -48,6 +77,24 @@ idx_transaction_date = HEADERS.index('entry_date')
 idx_TRANS_NARR = HEADERS.index('COMPARISON_FIELD')
 li_idx_narrs = [HEADERS.index(x) for x in NARRS[1:]]
 
+# column order of the output files. this is the key order the old dict/table round-trip in process_data
+# produced, kept so output stays byte-identical to earlier runs
+OUT_HEADERS = [k for k in {k: None for k in HEADERS} if k in AFTER_CLEAN]
+
+# columns kept by the parser - see row_parser.py. the OUT_HEADERS columns come first, so the output row is the start
+# of the parsed row, then any other column the checks or NARRS use. no other field is ever stripped or kept
+PARSED_HEADERS = OUT_HEADERS + [x for x in HEADERS if x not in OUT_HEADERS and
+                                x in ['entry_date', 'TRANS_amount', 'COMPARISON_FIELD'] + NARRS]
+li_idx_parsed = [HEADERS.index(x) for x in PARSED_HEADERS]
+
+# positions of the fields used by the checks in a parsed row
+pos_TRANS_amount = PARSED_HEADERS.index('TRANS_amount')
+pos_transaction_date = PARSED_HEADERS.index('entry_date')
+pos_TRANS_NARR = PARSED_HEADERS.index('COMPARISON_FIELD')
+
+# number of parsed rows run through the vectorised checks in prefilter_rows at a time
+PREFILTER_CHUNK_SIZE = 5000
+
 # used to
 MATCH_THRESHOLD = 0.6
 
@@ -58,6 +105,275 @@ def current_path():
     return curr_path
 
 
+def score_file(dat_file):
+    """
+    scores a single data file for rank_files. module level so it can be sent to a multiprocessing.Pool
+
+    returns:
+        inner_list(dict) = {'dat_file':..., 'date_match':..., 'score':...} or None if no dates match
+    """
+    m1 = 0.
+    m2 = 0.
+    inner_list = {'dat_file':dat_file}
+
+    if is_compressed(dat_file):
+        # compressed files are streamed in line-aligned blocks rather than mmapped
+        with open_data_file(dat_file) as f:
+            for block in iter_blocks(f):
+                m1 += len(re.findall(re_date_search, block))
+    else:
+        size = os.stat(dat_file).st_size
+        if size == 0:
+            return None  # mmap cannot map an empty file
+
+        f = open(dat_file)
+        data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        f.close()
+
+        m1 += len(re.findall(re_date_search, data))
+        # data.seek(0)
+        data.close()
+
+    if m1 != 0:
+        pass
+    #     m2 = len(re_bad_narratives.findall(data))
+    #     # m2 = len(re.findall(re_bad_narratives, data))
+    else:
+        return None
+    # m2 += max(1,m2)
+
+    inner_list.update({'date_match':m1})
+    # inner_list.update({'bad_narr_match':m2})
+
+    # too slow!!!
+    # m3 = 0
+    # for re_seed_as_a_list in self.re_seed_as_a_list:
+    #     m3 += len(re.findall(re_seed_as_a_list, data))
+
+    # inner_list.update({'seed_match':m3})
+    inner_list.update({'score': m1})
+    # inner_list.update({'score': m1/m2})
+
+    return inner_list
+
+
+def seed_tokens(seed_item):
+    """
+    the tokens of a cleaned seed item which count towards the seed densities
+    """
+    return [x for x in seed_item.split(' ') if len(x) > 2]
+
+
+def clean_seed_file(seed_file, delimiter='|'):
+    """
+    reads and cleans a single seed file. module level so the seed files can be sent to a multiprocessing.Pool
+
+    each narrative in the 't_desc' column has its tokens matching re_bad_seed removed
+
+    returns:
+        {'columns': {heading: [values]}, 'clean': [distinct cleaned narratives, in file order],
+         'token_counts': collections.Counter of seed_tokens over 'clean'}
+        or {'error': message} if the file cannot be read
+    """
+    #todo - make this specific to your own seed data!
+    heads = "t_desc|tag_name|counter_party|avg".split('|')
+
+    try:
+        fileHandle = open(seed_file, 'r')
+    except IOError as e:
+        return {'error': str(e)}
+
+    rows = [[x.strip() for x in l.split(delimiter)] for l in fileHandle]
+
+    fileHandle.close()
+
+    if len(rows[-1]) != len(heads):
+        rows = rows[:-1]
+
+    columns = {k[0]: list(k[1:]) for k in zip(*rows)}
+
+    clean = []
+    seen = set()
+    token_counts = collections.Counter()
+    for x in columns['t_desc']: # todo: update the 't_desc' key with the field name from your own narrative
+        x2 = [y.strip() for y in x.strip().split(' ')]
+        seed_item = ' '.join(item for item in x2 if not re.match(re_bad_seed, item))
+        if seed_item in seen:
+            continue
+        seen.add(seed_item)
+        clean.append(seed_item)
+        token_counts.update(seed_tokens(seed_item))
+
+    return {'columns': columns, 'clean': clean, 'token_counts': token_counts}
+
+
+# FileScorer / FileSampler used by score_file_with_scorer; set in each rank_files worker by init_file_scorer
+_file_scorer = None
+
+
+def init_file_scorer(file_scorer):
+    global _file_scorer
+    _file_scorer = file_scorer
+
+
+def score_file_with_scorer(dat_file):
+    """
+    scores a single data file with the scorer handed to init_file_scorer:
+        - FileScorer ('compound'): dates, bad narratives and seed phrases in one pass - see file_scorer.py
+        - FileSampler ('sample'): the rows of a few sampled blocks - see file_sampler.py
+
+    returns:
+        inner_list(dict) as the scorer's score method, or None if the file is not worth ranking
+    """
+    return _file_scorer.score(dat_file)
+
+
+def peak_rss_kb():
+    """
+    peak resident memory of this process in KB (as reported by linux)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def column_as_float(values):
+    """
+    returns float(x) for each of values as an array, plus a mask of the values float() accepted.
+    rejected values are nan in the array
+    """
+    try:
+        return np.array(values).astype(np.float64), np.ones(len(values), dtype=bool)
+    except (ValueError, OverflowError):
+        pass
+
+    # at least one bad value in the column - fall back to float() per value
+    floats = np.empty(len(values), dtype=np.float64)
+    valid = np.ones(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        try:
+            floats[i] = float(value)
+        except ValueError:
+            floats[i] = np.nan
+            valid[i] = False
+
+    return floats, valid
+
+
+def column_as_int(values):
+    """
+    returns int(x) for each of values as an array. as with int(), a bad value raises ValueError
+    """
+    try:
+        return np.array(values).astype(np.int64)
+    except (ValueError, OverflowError):
+        return np.array([int(value) for value in values])
+
+
+def chunked(iterable, size):
+    """
+    yields lists of up to size items from iterable, without reading more than one chunk ahead
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prefilter_keep(rows, row_ctr=0):
+    """
+    runs the cheap row checks of DiffEngine.prefilter_rows over the columns of a list of parsed rows, without
+    counting anything on an engine
+
+    returns:
+        keep(np.ndarray): indices of the rows passing all checks, ascending
+        rejects(list): (reject reason, number of rows) for each check
+    """
+    rejects = []
+
+    aligned = np.fromiter((len(row_data) for row_data in rows), dtype=np.int64, count=len(rows)) >= len(PARSED_HEADERS)
+    rejects.append(('misaligned', len(rows) - int(aligned.sum())))
+    if not aligned.all() and main_logger.isEnabledFor(logging.DEBUG):
+        main_logger.debug('rows %s misaligned to headers' % (np.flatnonzero(~aligned) + row_ctr).tolist())
+    keep = np.flatnonzero(aligned)
+
+    # each check only runs on the rows which passed the previous ones, as per the original row by row checks
+    if len(keep):
+        amounts, is_number = column_as_float([rows[i][pos_TRANS_amount] for i in keep])
+        if not is_number.all() and main_logger.isEnabledFor(logging.DEBUG):
+            main_logger.debug('rows %s misaligned to headers, bad TRANS_amount' %
+                              (keep[~is_number] + row_ctr).tolist())
+        with np.errstate(invalid='ignore'):  # nan amounts compare False, as float('nan') > 0 does
+            positive = is_number & (amounts > 0)
+        rejects.append(('amount_invalid', len(keep) - int(is_number.sum())))
+        rejects.append(('amount_positive', int(positive.sum())))
+        keep = keep[is_number & ~positive]
+
+    if len(keep):
+        dates = np.array([rows[i][pos_transaction_date] for i in keep])
+        years = column_as_int(np.char.partition(dates, '/')[:, 0].tolist())
+        rejects.append(('date', int((years < 2011).sum())))
+        keep = keep[years >= 2011]  # exclude row if pre 2011
+
+    if len(keep):
+        narrs = np.array([rows[i][pos_TRANS_NARR] for i in keep])
+        long_enough = np.char.str_len(narrs) >= 2
+        rejects.append(('empty_narrative', len(keep) - int(long_enough.sum())))
+        keep = keep[long_enough]
+
+    return keep, rejects
+
+
+def easy_reject_reason(comparator, already_checked, seed_items):
+    """
+    the easy checks at the start of DiffEngine.check_narrative, which need no seed statistics
+
+    returns:
+        the reject reason for comparator, or None if it passes
+    """
+    if len(comparator) < 3:
+        return 'short_comparator'
+
+    if 'SOME STRING' in comparator or 'ANOTHER STRING' in comparator:
+        return 'excluded_string'
+
+    if comparator in already_checked:
+        return 'already_checked'
+
+    if comparator in seed_items:
+        return 'seed_match'
+
+    return None
+
+
+# trace line logged for each easy_reject_reason
+EASY_CHECK_MESSAGES = {'short_comparator': 'comparator %s rejected - too short ',
+                       'excluded_string': 'comparator %s rejected',
+                       'already_checked': 'comparator %s already checked',
+                       'seed_match': 'comparator %s in seed tokens'}
+
+
+def count_passing_rows(rows, seed_items):
+    """
+    how many of a list of parsed rows pass prefilter_keep, the bad narrative regexes and easy_reject_reason - ie would
+    reach the density checks of DiffEngine.check_narrative. a narrative repeated within rows only passes once, as the
+    engine rejects the repeats as already checked. the row checks of the 'sample' ranking - see file_sampler.py
+    """
+    keep, rejects = prefilter_keep(rows)
+
+    seen = set()
+    passing = 0
+    for i in keep.tolist():
+        narr = re.sub(r'\s{2,}', ' ', rows[i][pos_TRANS_NARR])
+        if re_bad_narratives.match(narr) or re_dead_narratives.match(narr):
+            continue
+        if easy_reject_reason(narr, seen, seed_items) is None:
+            passing += 1
+        seen.add(narr)
+
+    return passing
+
+
 class DiffEngine(object):
     """
     The DiffEngine takes an input list of strings which it compares
@@ -96,8 +412,8 @@ class DiffEngine(object):
     - ensure the loggers.py and regex_filters.py files are in the same location as the DiffEngine
     [or update the imports]
 
-    - a seed data file should be in the same location as the DiffEngine file.
-    see the load_seed_data() method for more information on how this is used, and be mindful of the #todo's !
+    - one or more seed data files (*.seed) should be in the same location as the DiffEngine file; they are merged
+    into a single seed. see the clean_seed_file() function for more information on how this is used, and be mindful of the #todo's !
 
     - The input data to compare against the seed should be in the 'dat' directory
     in the same location as the DiffEngine file
@@ -111,64 +427,246 @@ class DiffEngine(object):
 
     """
     def __init__(self, **kwargs):
+        if kwargs.get('async_logging', False):
+            # log files are written from a listener thread instead of the calling thread
+            start_async_logging()
+        # fraction of the per-token / per-comparator classifier trace lines which are logged
+        set_trace_sample_rate(kwargs.get('trace_sample_rate', 1.0))
+
         main_logger.info('*****NEW PROCESS STARTING')
+        self.kwargs = kwargs  # for the sequential run of the shard drift check
         # get fileloc from kwargs or current_path()
         self.fileloc = kwargs.get('fileloc', current_path())
 
         self.data_ext = kwargs.get('ext', '*.dat')
         self.data_file_path = os.path.join(self.fileloc, self.data_ext)
         self.outfile = kwargs.get('outfile', 'out/outfile0.out')
+        self.prefilter_chunk_size = kwargs.get('prefilter_chunk_size', PREFILTER_CHUNK_SIZE)
+        self.workers = kwargs.get('workers', 1)  # processes used by rank_files and to load the seed files
+        self.rank_cache = kwargs.get('rank_cache', True)  # reuse scores of unchanged files between runs
+        self.rank_by = kwargs.get('rank_by', 'dates')  # one of RANK_MODES
+        # blocks sampled from each file, and bytes per block, for rank_by 'sample'
+        self.rank_sample_blocks = kwargs.get('rank_sample_blocks', SAMPLE_BLOCKS)
+        self.rank_sample_bytes = kwargs.get('rank_sample_bytes', SAMPLE_BLOCK_BYTES)
+        # processes decompressing upcoming compressed data files while the current one is processed; 0 for none
+        self.decompress_workers = kwargs.get('decompress_workers', 0)
+        self.prefetcher = None
 
         self.processed_rows = 0
         self.skipped_rows = 0
         self.outfile_ctr = 0
         self.delimiter = '|'
-        self.seed_files = os.path.join(current_path(), '*.seed')
-
-        main_logger.info('loading %s' % self.seed_files)
-        #warning only supports a single .seed file currently
-        for c, dat_file in enumerate(glob.iglob(os.path.join(self.seed_files))):
-            self.load_seed_data(dat_file)  #creates self.seed
-
-        self.already_checked = set()
-        self.density_fail = set()
+        self.row_parser = RowParser(len(HEADERS), li_idx_parsed, self.delimiter)
+        # buffered, rotating writer for the accepted rows - see output_writer.py
+        self.writer = OutputWriter(os.path.join(current_path(), self.outfile), OUT_HEADERS,
+                                   rotate_bytes=kwargs.get('rotate_bytes', ROTATE_BYTES),
+                                   buffer_bytes=kwargs.get('write_buffer', WRITE_BUFFER_BYTES),
+                                   background=kwargs.get('background_write', False),
+                                   compress=kwargs.get('gzip_output', False),
+                                   delimiter=self.delimiter)
+
+        self.seed_files = kwargs.get('seed_files', os.path.join(current_path(), '*.seed'))  # glob of seed files
+        self.seed_snapshot = kwargs.get('seed_snapshot', os.path.join(current_path(), SEED_SNAPSHOT_FILENAME))
+
+        # 'exact' keeps every narrative seen; 'hash' and 'bloom' trade exactness for memory - see membership.py
+        self.membership = kwargs.get('membership', 'exact')
+        self.bloom_capacity = kwargs.get('bloom_capacity', BLOOM_CAPACITY)
+        self.bloom_error_rate = kwargs.get('bloom_error_rate', BLOOM_ERROR_RATE)
+        self.already_checked = new_membership_set(self.membership, self.bloom_capacity, self.bloom_error_rate)
+        self.density_fail = new_membership_set(self.membership, self.bloom_capacity, self.bloom_error_rate)
+        self.token_cache = TokenClassCache(kwargs.get('token_cache_size', TOKEN_CACHE_SIZE))
+        # also reject comparators whose character shingles are close to a seed item or accepted row - see
+        # near_duplicates.py. None when the check is off
+        self.near_duplicates = None
+        # keep only the top_k most novel narratives over the whole run instead of accepting greedily; 0 for greedy
+        self.top_k = TopKHeap(kwargs['top_k']) if kwargs.get('top_k', 0) else None
+        self.near_duplicate_kwargs = {'threshold': kwargs.get('near_dup_threshold', NEAR_DUP_THRESHOLD),
+                                      'bands': kwargs.get('near_dup_bands', NEAR_DUP_BANDS),
+                                      'rows': kwargs.get('near_dup_rows', NEAR_DUP_ROWS),
+                                      'shingle_size': kwargs.get('shingle_size', SHINGLE_SIZE)}
+        self.run_stats = RunStats()
+        self.run_stats_file = kwargs.get('run_stats', 'logs/run_stats.json')  # written at the end of get_files
+
+        # checkpoint the engine state every checkpoint_every input rows; 0 turns checkpoints off
+        self.checkpoint_every = kwargs.get('checkpoint_every', 0)
+        self.checkpoint_file = kwargs.get('checkpoint', os.path.join(current_path(), 'out', CHECKPOINT_FILENAME))
+        self.rows_since_checkpoint = 0
+        self.resume_position = (0, 0)  # (index into self.ranked_files, rows already read from that file)
+        self.known_files = []  # every data file rank_files has scored, ranked or not - see watch()
+        self.resuming = False  # the outfile for the file at resume_position was picked before the checkpoint
+
+        # split the ranked files over this many worker processes, syncing their seeds every shard_sync_rows rows
+        self.shards = kwargs.get('shards', 1)
+        self.shard_sync_rows = kwargs.get('shard_sync_rows', SHARD_SYNC_ROWS)
+        self.shard_drift_check = kwargs.get('shard_drift_check', False)  # also run sequentially and compare
+
+        # keep the engine warm and process new data files as they land - see watch(). a watch resumes from the
+        # checkpoint of the last one, if there is one
+        self.watch_mode = kwargs.get('watch', False)
+        self.watch_poll_seconds = kwargs.get('watch_poll_seconds', WATCH_POLL_SECONDS)
+        self.watch_flush_seconds = kwargs.get('watch_flush_seconds', WATCH_FLUSH_SECONDS)
+        self.watch_idle_exit = kwargs.get('watch_idle_exit', 0)  # seconds without a new file before stopping; 0 never
+
+        if self.shards > 1 and (self.top_k is not None or self.checkpoint_every or self.watch_mode or
+                                kwargs.get('resume', False)):
+            main_logger.warning('sharded mode does not support top-K, checkpoints, watch or resume - running in one '
+                                'process')
+            self.shards = 1
+
+        # stop reading files whose acceptance rate falls below yield_floor, or move them to the back of the queue -
+        # see file_yield.py. None when every file is read to the end
+        self.yield_monitor = None
+        if kwargs.get('yield_policy', 'off') != 'off':
+            if self.shards > 1:
+                main_logger.warning('sharded mode reads every file to the end - ignoring yield_policy')
+            else:
+                self.yield_monitor = YieldMonitor(kwargs['yield_policy'],
+                                                  floor=kwargs.get('yield_floor', YIELD_FLOOR),
+                                                  min_rows=kwargs.get('yield_min_rows', YIELD_MIN_ROWS),
+                                                  window=kwargs.get('yield_window', YIELD_WINDOW),
+                                                  settle_rate=kwargs.get('yield_settle_rate', SETTLE_RATE))
+        self.accept_log = None  # list collecting (comparator, modified_comparator) of each accepted narrative
+
+        if kwargs.get('compile_seed', False):
+            # compile the .seed files to self.seed_snapshot and stop - no data files are ranked
+            self.compile_seed()
+            self.ranked_files = []
+        else:
+            # a checkpoint holds the seed as it was when it was taken, so resuming skips loading and ranking
+            restored = (kwargs.get('resume', False) or self.watch_mode) and self.restore_checkpoint()
+            if not restored:
+                self.load_seed()
+            if kwargs.get('near_duplicates', False) and self.near_duplicates is None:
+                self.build_near_duplicate_index()
+            if not restored:
+                self.rank_files()
 
-        seed_as_a_list = [x for x in ' '.join(self.seed['t_desc_clean']).split(' ') if len(x) > 2]
+        self.current_dat_file = None  # used in the load process
 
-        self.re_seed_as_a_list = []
-        for x in xrange(len(self.seed['t_desc_clean'])):
-            self.re_seed_as_a_list.append(r"("+')|('.join(list(self.seed['t_desc_clean'])[x:x+80])+")")
-            x+=80
+    def load_seed(self):
+        """
+        creates self.seed, self.seed_density and self.seed_index from the seed snapshot when it is fresh,
+        otherwise from the .seed files
+        """
+        seed_files = sorted(glob.glob(self.seed_files))
+
+        state = load_seed_snapshot(self.seed_snapshot, seed_files)
+        if state is not None:
+            main_logger.info('loading seed snapshot %s' % self.seed_snapshot)
+            self.seed = state['seed']
+            self.seed_density = state['seed_density']
+            self.seed_index = state['seed_index']
+            self.token_ids = self.seed_density.dictionary
+        else:
+            self.load_seed_files(seed_files)
 
         main_logger.info('creating seed stats')
-        self.seed_density = {str(x): seed_as_a_list.count(x) for x in seed_as_a_list}
+        self.seed_density_stats = SeedDensityStats(self.seed_density.itervalues())
         self.seed_stats = {}
         self.build_seed_stats()
         main_logger.info('completed seed stats')
-        self.rank_files()
-        self.current_dat_file = None  # used in the load process
+
+    def load_seed_files(self, seed_files):
+        """
+        creates self.seed, self.seed_density and self.seed_index from all of seed_files, cleaning the files in
+        parallel when self.workers > 1 and merging them in the order given
+        """
+        main_logger.info('loading %s with %s worker(s)' % (self.seed_files, self.workers))
+        self.seed = {'t_desc_clean': set()}
+
+        clean = functools.partial(clean_seed_file, delimiter=self.delimiter)
+        if self.workers > 1 and len(seed_files) > 1:
+            pool = multiprocessing.Pool(min(self.workers, len(seed_files)))
+            try:
+                cleaned_files = pool.map(clean, seed_files)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            cleaned_files = map(clean, seed_files)
+
+        token_counts = collections.Counter()
+        for seed_file, cleaned in zip(seed_files, cleaned_files):
+            token_counts.update(self.merge_seed_file(seed_file, cleaned))
+
+        # token ids for the densities and the seed index - see token_ids.py
+        self.token_ids = TokenDictionary()
+        self.seed_density = TokenDensities(self.token_ids,
+                                           sorted((str(k), v) for k, v in token_counts.iteritems() if v > 0))
+        self.build_seed_index()
+
+    def merge_seed_file(self, seed_file, cleaned):
+        """
+        adds the output of clean_seed_file to self.seed
+
+        returns:
+            token_counts(collections.Counter): seed_tokens counts of the seed items not already in self.seed
+        """
+        if 'error' in cleaned:
+            main_logger.error('could not load seed file %s: %s' % (seed_file, cleaned['error']))
+            return collections.Counter()
+
+        for k, column in cleaned['columns'].iteritems():
+            self.seed.setdefault(k, []).extend(column)
+
+        token_counts = cleaned['token_counts']
+        for seed_item in cleaned['clean']:
+            if seed_item in self.seed['t_desc_clean']:
+                token_counts.subtract(seed_tokens(seed_item))  # already counted for an earlier seed file
+            else:
+                self.add_seed_item(seed_item)
+
+        main_logger.info('merged %s: %s seed items' % (seed_file, len(cleaned['clean'])))
+        return token_counts
+
+    def compile_seed(self):
+        """
+        loads the .seed files and writes the cleaned seed, token densities and seed index to self.seed_snapshot
+        so later runs can skip tokenising the seed
+        """
+        seed_files = sorted(glob.glob(self.seed_files))
+        self.load_seed_files(seed_files)
+
+        return write_seed_snapshot(self.seed_snapshot, seed_files, {'seed': self.seed,
+                                                                    'seed_density': self.seed_density,
+                                                                    'seed_index': self.seed_index})
 
 
     def build_seed_stats(self):
-        self.seed_stats['mean'] = np.average(self.seed_density.values())
-        self.seed_stats['stddev'] = np.std(self.seed_density.values())
-        self.seed_stats['densities'] = sorted(set(self.seed_density.values()), reverse=True)
+        # read from the running totals in self.seed_density_stats rather than a pass over self.seed_density
+        self.seed_stats['mean'] = np.float64(self.seed_density_stats.mean())
+        self.seed_stats['stddev'] = np.float64(self.seed_density_stats.stddev())
+        self.seed_stats['densities'] = self.seed_density_stats.densities()
 
         self.lower_gap = max(0.25, (self.skipped_rows)/(1 + self.processed_rows))
 
         self.seed_stats['lower_threshold'] = np.ceil(self.seed_stats['mean']/10)
         self.seed_stats['upper_threshold'] = self.seed_stats['mean'] + 10 * self.seed_stats['stddev']
 
-        classifier_logger.info("THRESHOLDS: %s\t%s\t%s"%(self.seed_stats['lower_threshold'],
+        classifier_logger.info("THRESHOLDS: %s\t%s\t%s", self.seed_stats['lower_threshold'],
                                                          self.seed_stats['mean'],
-                                                         self.seed_stats['upper_threshold']))
+                                                         self.seed_stats['upper_threshold'])
 
-        final_stats.info("THRESHOLDS: %s\t%s\t%s"%(self.seed_stats['lower_threshold'],
+        final_stats.info("THRESHOLDS: %s\t%s\t%s", self.seed_stats['lower_threshold'],
                                                          self.seed_stats['mean'],
-                                                         self.seed_stats['upper_threshold']))
+                                                         self.seed_stats['upper_threshold'])
         # print self.seed['t_desc_clean']
         pass
 
+    def increment_seed_density(self, token):
+        old_density = self.seed_density.get(token, 0)
+        self.seed_density[token] = old_density + 1
+        self.seed_density_stats.update(old_density, old_density + 1)
+
+    def decrement_seed_density(self, token):
+        old_density = self.seed_density[token]
+        if old_density == 1:
+            del self.seed_density[token]
+            self.seed_density_stats.remove(old_density)
+        else:
+            self.seed_density[token] = old_density - 1
+            self.seed_density_stats.update(old_density, old_density - 1)
+
     def dataAsTableFromDict(self, dataAsDict):
         return zip(*list([[k] + dataAsDict[k] for k in dataAsDict]))
 
@@ -176,159 +674,201 @@ class DiffEngine(object):
     def dataAsDictFromTable(self, dataAsTable):
         return {k[0]: list(k[1:]) for k in zip(*dataAsTable)}
 
-    def load_seed_data(self, seed_file):
-        #todo - make this specific to your own seed data!
-        heads = "t_desc|tag_name|counter_party|avg".split('|')
-        starter = 1
-        Wants = heads
-
-        try:
-            fileHandle = open(seed_file, 'r')
-        except IOError as e:
-            main_logger.error(e)
-            return e
-
-        rows = [[x.strip() for x in l.split(self.delimiter)] for l in fileHandle]
-
-        fileHandle.close()
+    def build_near_duplicate_index(self):
+        """
+        creates self.near_duplicates and indexes the cleaned seed narratives in it
+        """
+        main_logger.info('building near duplicate index with %s' % self.near_duplicate_kwargs)
+        self.near_duplicates = NearDuplicateIndex(**self.near_duplicate_kwargs)
+        self.near_duplicates.add_many(sorted(self.seed['t_desc_clean']))
+        main_logger.info('near duplicate index built with %s items' % len(self.near_duplicates))
 
-        if len(rows[-1]) != len(heads):
-            rows = rows[:-1]
+    def add_seed_item(self, seed_item):
+        """
+        adds a cleaned narrative to self.seed['t_desc_clean']. build_seed_index has to be run once all items are in
 
-        self.seed = self.dataAsDictFromTable(rows)
+        args:
+            seed_item(str): cleaned, space separated seed narrative
+        """
+        self.seed['t_desc_clean'].add(seed_item)
 
-        self.seed['t_desc_clean'] = set()
-        for x in self.seed['t_desc']: # todo: update the 't_desc' key with the field name from your own narrative
-            x2 = [y.strip() for y in x.strip().split(' ')]
-            # l = [item for item in x2 if not re.match(re_bad_seed,item)]
-            l = []
-            for item in x2:
-                if re.match(re_bad_seed, item):
-                    continue
-                else:
-                    l.append(item)
-            self.seed['t_desc_clean'].add(' '.join(l))
+    def build_seed_index(self):
+        """
+        creates self.seed_index over the token ids of the t_desc_clean items, in sorted order
+        """
+        self.seed_index = SeedIndex([self.token_ids.add(token) for token in seed_item.strip().split(' ')]
+                                    for seed_item in sorted(self.seed['t_desc_clean']))
+        main_logger.info('seed index built: %s items, %s tokens' % (len(self.seed_index), len(self.token_ids) - 1))
 
 
     def xsvParser(self, fileLoc):
         """
-        loads delimited files to dictionaries
+        loads a delimited file and returns the processed rows as a table
 
         args:
             fileLoc(str): full path to delimited data file - include the file itself
 
 
         Output:
-            single_series_flat == false: dataAsDict(dict) = { row or col header : [ series in row or col ] }
+            table(list) = [OUT_HEADERS, accepted row, accepted row, ...]
 
+        this holds every accepted row in memory - get_files streams via iter_xsv_rows / filter_rows instead
         """
 
-        try:
-            fileHandle = open(fileLoc, 'r')
-        except IOError as e:
-            main_logger.error(e)
-            return e
+        return self.process_data(self.iter_xsv_rows(fileLoc))
 
-        # todo: the conversion of '|?' to '|' was a quirk of the dataset I was using.
-        # Feel free to remove this if not useful
+    def iter_xsv_rows(self, fileLoc, skip=0):
+        """
+        yields each line of a delimited file parsed by self.row_parser, one line at a time: a list of the stripped
+        PARSED_HEADERS fields, or [] for a line with too few fields
 
-        rows = [[x.strip() for x in l.replace('|?', '|').split(self.delimiter)] for l in fileHandle]
-        fileHandle.close()
-        rows = self.process_data(rows)
+        args:
+            fileLoc(str): full path to delimited data file - include the file itself
+            skip(int): number of lines to pass over unparsed first, eg when resuming from a checkpoint
+        """
 
-        return rows
+        if self.prefetcher is not None and fileLoc in self.prefetcher:
+            # already being decompressed by a prefetch worker
+            lines = self.prefetcher.lines(fileLoc)
+            fileHandle = contextlib.closing(lines)
+        else:
+            try:
+                fileHandle = lines = open_data_file(fileLoc)
+            except IOError as e:
+                main_logger.error(e)
+                return
 
+        with fileHandle:
+            for row_data in self.row_parser.parse_lines(itertools.islice(lines, skip, None)):
+                yield row_data
 
     def process_data(self, all_rows):
+        """
+        returns a table of the accepted rows from all_rows, headed by OUT_HEADERS
+        """
 
-        dat = [HEADERS]
-
-        for row_ctr, row_data in enumerate(all_rows):
-            self.processed_rows +=1
+        dat = [OUT_HEADERS]
+        dat.extend(self.filter_rows(all_rows))
 
-            if len(row_data) < len(HEADERS):
-                main_logger.debug('row %s misaligned to headers'%(row_ctr))
-                self.skipped_rows +=1
-                continue  # bad row
+        return dat
 
+    def filter_rows(self, all_rows, row_ctr=0):
+        """
+        yields the rows from all_rows which pass all checks, projected to the OUT_HEADERS columns
 
-            try:
-                row_trans_amount = float(row_data[idx_TRANS_amount])
-            except ValueError, e:
-                main_logger.debug('row %s misaligned to headers, %s'%(row_ctr, e))
-                self.skipped_rows +=1
-                continue
+        args:
+            all_rows(iterable): parsed rows, as per iter_xsv_rows
+            row_ctr(int): position of the first row in its file, for logging
+        """
 
-            if row_trans_amount > 0:
-                self.skipped_rows +=1
-                continue
+        out_fields = len(OUT_HEADERS)
+        run_stats = self.run_stats
 
-            if int(row_data[idx_transaction_date].split('/')[0]) < 2011: # exclude row if pre 2011
-                self.skipped_rows +=1
-                continue
+        for row_data in self.iter_prefiltered_rows(all_rows, row_ctr):
+            t0 = time.time()
 
+            row_data[pos_TRANS_NARR] = re.sub(r'\s{2,}', ' ', row_data[pos_TRANS_NARR])
 
-            if row_data[idx_TRANS_NARR] == '' or row_data[idx_TRANS_NARR] == " " or len(row_data[idx_TRANS_NARR]) < 2:
+            if re_bad_narratives.match(row_data[pos_TRANS_NARR]) or re_dead_narratives.match(row_data[pos_TRANS_NARR]):
                 self.skipped_rows +=1
+                run_stats.reject('bad_narrative')
+                run_stats.add_time('regex', time.time() - t0)
                 continue
 
-            row_data[idx_TRANS_NARR] = re.sub(r'\s{2,}', ' ', row_data[idx_TRANS_NARR])
+            t1 = time.time()
+            run_stats.add_time('regex', t1 - t0)
 
-            if re_bad_narratives.match(row_data[idx_TRANS_NARR]) or re_dead_narratives.match(row_data[idx_TRANS_NARR]):
-                self.skipped_rows +=1
-                continue
+            if self.top_k is None:
+                picked = self.pick_or_reject_narrative(row_data[pos_TRANS_NARR])  # records its own reject reason
+            else:
+                # held in self.top_k rather than yielded, and written at the end of get_files
+                picked = self.offer_top_k(row_data[pos_TRANS_NARR], row_data[:out_fields])
+            run_stats.add_time('pick', time.time() - t1)
 
-            if not self.pick_or_reject_narrative(row_data[idx_TRANS_NARR]):
+            if not picked:
                 self.skipped_rows +=1
                 continue
 
-            dat.append(row_data)
+            if self.top_k is None:
+                yield row_data[:out_fields]
 
-        dat = self.dataAsDictFromTable(dat)
+    def iter_prefiltered_rows(self, all_rows, row_ctr=0):
+        """
+        runs the cheap checks from prefilter_rows over chunks of all_rows and yields the surviving rows in order
+        """
+        for chunk in chunked(all_rows, self.prefilter_chunk_size):
+            for row_data in self.prefilter_rows(chunk, row_ctr):
+                yield row_data
+            row_ctr += len(chunk)
 
-        for k in dat.keys():
-            if k not in AFTER_CLEAN: del dat[k]
+    def prefilter_rows(self, rows, row_ctr=0):
+        """
+        applies the cheap row checks as vectorised operations over the columns of a chunk of rows:
+        - fewer fields than HEADERS (parsed to an empty row)
+        - TRANS_amount not a number, or greater than 0
+        - entry_date before 2011
+        - narrative shorter than 2 characters
 
-        dat = self.dataAsTableFromDict(dat)
+        counts every row in processed_rows and every rejected row in skipped_rows
 
-        return dat
+        args:
+            rows(list): parsed rows, as per iter_xsv_rows
+            row_ctr(int): position of the first row in its file, for logging
 
-    def pick_or_reject_narrative(self, comparator):
-        # list_of_things_to_find = []
-        # for comparator in list_of_things_to_find:
+        returns:
+            survivors(list): the rows passing all checks, in their original order
+        """
+        t0 = time.time()
+        self.processed_rows += len(rows)
+        self.run_stats.rows(len(rows))
 
+        keep, rejects = prefilter_keep(rows, row_ctr)
+        for reason, count in rejects:
+            self.run_stats.reject(reason, count)
 
-        density_check_failed = False
-        comparator_tokens_with_bad_density = 0.
-        density_threshold = 0.4
+        self.skipped_rows += len(rows) - len(keep)
+        self.run_stats.add_time('prefilter', time.time() - t0)
 
-        # easy checks
-        if len(comparator) < 3:
-            classifier_logger.debug('comparator %s rejected - too short '%comparator)
-            return False
+        return [rows[i] for i in keep]
 
-        if 'SOME STRING' in comparator or 'ANOTHER STRING' in comparator:
-            classifier_logger.debug('comparator %s rejected'%comparator)
-            return False
+    def pick_or_reject_narrative(self, comparator):
+        """
+        accepts comparator into the seed if it passes check_narrative
 
-        if comparator in self.already_checked:
-            classifier_logger.debug('comparator %s already checked'%comparator)
+        returns:
+            picked(bool)
+        """
+        checked = self.check_narrative(comparator)
+        if checked is False:
             return False
 
-        if comparator in self.seed['t_desc_clean']:
-            classifier_logger.debug('comparator %s in seed tokens'%comparator)
-            return False
-        # end easy checks
+        t0 = time.time()
+        modified_comparator, coverage = checked
+        self.accept_narrative(comparator, modified_comparator)
+        self.run_stats.add_time('accept', time.time() - t0)
+        return True
 
-        classifier_logger.info("STARTING comparator %s"%comparator)
+    def fails_density_check(self, comparator, tokens, densities):
+        """
+        the density check of check_narrative: whether too many of the tokens of comparator have a seed density in the
+        unwanted range between the lower and upper thresholds. a failure is only acted on at the token after the one
+        it happens on, as it always has been, so a comparator failing on its last token passes
 
-        # check comparator is 'different' enough from other stuff we have
-        for c in comparator.strip().split(' '):
+        args:
+            comparator(str): for the trace log
+            tokens(list): comparator.strip().split(' ')
+            densities(list): seed density of each of tokens
+        """
+        density_check_failed = False
+        comparator_tokens_with_bad_density = 0.
+        density_threshold = 0.4
+
+        lower_threshold = float(self.seed_stats['lower_threshold'])
+        upper_threshold = float(self.seed_stats['upper_threshold'])
+        for c, density in zip(tokens, densities):
 
             if density_check_failed:
-                self.already_checked.add(comparator)
-                self.density_fail.add(comparator)
-                return False
+                return True
 
             if len(c) < 1:
                 density_threshold *= 0.75
@@ -336,183 +876,478 @@ class DiffEngine(object):
 
             # if comparator words are in re_bad_* lists, then lower density threshold and move to next word
             # if re.match(re_bad_seed, c) or re.match(re_bad_narratives, c):
-            if re_bad_seed.match(c) or re_bad_narratives.match(c):
+            token_class = self.token_cache.classify(c)
+            if token_class.bad_seed or token_class.bad_narrative:
                 density_threshold *= 0.75
                 continue
 
             if len(c) < 4:
                 density_threshold *= 0.75
 
-            if re_dead_narratives.match(c):
+            if token_class.dead_narrative:
                 density_threshold *= 0.3
 
-            classifier_logger.info("current density of token %s:\t%s"%(c, self.seed_density.get(c,0)))
+            trace_logger.info("current density of token %s:\t%s", c, density)
             # check if eligible tokens in comparator are in the unwanted density range
-            if self.seed_stats['lower_threshold'] < self.seed_density.get(c, 0) < self.seed_stats['upper_threshold']:
+            if lower_threshold < density < upper_threshold:
 
                 comparator_tokens_with_bad_density += 1
 
                 # only check if something has changed
-                if (comparator_tokens_with_bad_density / len(comparator.strip().split(' '))) >= density_threshold:
+                if (comparator_tokens_with_bad_density / len(tokens)) >= density_threshold:
                     # fails if too many token in the comparator have unwanted density
                     density_check_failed = True
-                    classifier_logger.warning('comparator %s failed density check on %s'%(comparator, c))
+                    trace_logger.warning('comparator %s failed density check on %s', comparator, c)
+
+        return False
 
+    def check_narrative(self, comparator):
+        """
+        runs the checks deciding whether comparator is different enough from the seed and everything accepted so far
+
+        returns:
+            False if comparator is rejected, otherwise (modified_comparator, coverage) where coverage is the highest
+            coverage of a seed item by the modified comparator
+        """
+        # list_of_things_to_find = []
+        # for comparator in list_of_things_to_find:
+        run_stats = self.run_stats
 
+        # easy checks
+        t0 = time.time()
+        reason = easy_reject_reason(comparator, self.already_checked, self.seed['t_desc_clean'])
+        t1 = time.time()
+        run_stats.add_time('easy_checks', t1 - t0)
+        if reason is not None:
+            trace_logger.debug(EASY_CHECK_MESSAGES[reason], comparator)
+            run_stats.reject(reason)
+            return False
+        # end easy checks
+
+        trace_logger.info("STARTING comparator %s", comparator)
+
+        # check comparator is 'different' enough from other stuff we have
+        tokens = comparator.strip().split(' ')
+        densities = self.seed_density.lookup(tokens)  # one gather from the density array for all the tokens
+        density_check_failed = self.fails_density_check(comparator, tokens, densities)
+        t0 = time.time()
+        run_stats.add_time('density_check', t0 - t1)
+        if density_check_failed:
+            self.already_checked.add(comparator)
+            self.density_fail.add(comparator)
+            run_stats.reject('density_fail')
+            return False
 
         # now worth building the modified comparator
-        modified_comparator = [c for c in comparator.strip().split(' ') if
-                               (len(c) > 0 and not re.match(re_bad_seed, c))]
+        modified_comparator = [c for c in tokens if (len(c) > 0 and not self.token_cache.classify(c).bad_seed)]
 
-        classifier_logger.debug('modified comparator %s created for comparator %s'%(modified_comparator, comparator))
+        trace_logger.debug('modified comparator %s created for comparator %s', modified_comparator, comparator)
 
         # easy checks on modified comparator
         if ' '.join(modified_comparator) in self.already_checked:
-            classifier_logger.debug('modified comparator already checked for comparator %s'%comparator)
+            trace_logger.debug('modified comparator already checked for comparator %s', comparator)
+            run_stats.add_time('coverage_check', time.time() - t0)
+            run_stats.reject('modified_already_checked')
             return False
 
         if ' '.join(modified_comparator) in self.seed['t_desc_clean']:
-            classifier_logger.debug('modified comparator in seed tokens for comparator %s'%comparator)
+            trace_logger.debug('modified comparator in seed tokens for comparator %s', comparator)
+            run_stats.add_time('coverage_check', time.time() - t0)
+            run_stats.reject('modified_seed_match')
             return False
 
-        # check if comparator is in any item in seed_list
-        for seed_item in self.seed['t_desc_clean']:
-            comparator_coverage_for_seed_list_item = self.get_comparator_coverage_for_seed_list_item(
-                seed_item, modified_comparator)
-
-            if comparator_coverage_for_seed_list_item is False:  # bad seed_item
-                continue
+        # check if comparator is in any item in seed_list: rejected if the seed item it covers most is covered by
+        # more than MATCH_THRESHOLD. only seed items sharing a token with it can have a non-zero coverage
+        seed_item_id, coverage = self.seed_index.coverage(set(self.token_ids.lookup(modified_comparator)))
+        t1 = time.time()
+        run_stats.add_time('coverage_check', t1 - t0)
+        if coverage > MATCH_THRESHOLD:
+            self.already_checked.add(' '.join(modified_comparator))
+            self.already_checked.add(comparator)
+            str_ = "comparator_coverage_for_seed_list_item > MATCH_THRESHOLD"
+            flt_ = str(coverage)
+            flt_ = flt_[:min(5,len(flt_))]
+            trace_logger.debug('%s = %s for comparator %s on seed_item %s', str_, flt_, comparator,
+                               self.token_ids.decode(self.seed_index.item(seed_item_id)))
+            run_stats.reject('coverage_match')
+            return False
 
-            if comparator_coverage_for_seed_list_item > MATCH_THRESHOLD:
+        # check the modified comparator is not a near duplicate of a seed item or an accepted row on characters
+        if self.near_duplicates is not None:
+            near_duplicate = self.near_duplicates.find(' '.join(modified_comparator))
+            run_stats.add_time('near_duplicate', time.time() - t1)
+            if near_duplicate is not None:
                 self.already_checked.add(' '.join(modified_comparator))
                 self.already_checked.add(comparator)
-                str_ = "comparator_coverage_for_seed_list_item > MATCH_THRESHOLD"
-                flt_ = str(comparator_coverage_for_seed_list_item)
-                flt_ = flt_[:min(5,len(flt_))]
-                classifier_logger.debug('%s = %s for comparator %s on seed_item %s'%(str_, flt_, comparator, seed_item))
+                trace_logger.debug('comparator %s is a near duplicate of %s', comparator, near_duplicate)
+                run_stats.reject('near_duplicate')
                 return False
 
         # if all tests fail, then this is a genuinely new thing and we should keep it
+        return modified_comparator, coverage
+
+    def accept_narrative(self, comparator, modified_comparator):
+        """
+        adds a narrative which passed check_narrative to the seed
+        """
+        self.record_accepted(comparator, modified_comparator)
+        if self.accept_log is not None:
+            self.accept_log.append((comparator, modified_comparator))
+        classifier_logger.critical('SUCCESS on comparator %s with modified_comarator %s', comparator, modified_comparator)
+        self.build_seed_stats()
+        self.run_stats.accept()
+
+    def record_accepted(self, comparator, modified_comparator):
+        """
+        marks an accepted narrative as checked and adds its tokens to the seed densities, without rebuilding the
+        seed stats
+        """
         self.already_checked.add(comparator)
         self.already_checked.add(' '.join(modified_comparator))
 
         # add it to the seed list
         for mc in modified_comparator:
-            self.seed_density[mc] = self.seed_density.get(mc, 0) + 1
-        classifier_logger.critical('SUCCESS on comparator %s with modified_comarator %s'%(comparator, modified_comparator))
+            self.increment_seed_density(mc)
+        if self.near_duplicates is not None:
+            self.near_duplicates.add(' '.join(modified_comparator))
+
+    def offer_top_k(self, comparator, row):
+        """
+        top-K mode: scores comparator on its novelty if it passes check_narrative and keeps row in self.top_k if it is
+        among the K most novel so far. the tokens of kept narratives count towards the seed until they are evicted
+
+        returns:
+            kept(bool)
+        """
+        checked = self.check_narrative(comparator)
+        if checked is False:
+            return False
+
+        t0 = time.time()
+        modified_comparator, coverage = checked
+        self.already_checked.add(comparator)
+        self.already_checked.add(' '.join(modified_comparator))
+
+        score = novelty_score(modified_comparator, self.seed_density, coverage)
+        if not self.top_k.admits(score):
+            trace_logger.debug('comparator %s not in the top %s with novelty %s', comparator, self.top_k.k, score)
+            self.run_stats.add_time('accept', time.time() - t0)
+            self.run_stats.reject('top_k')
+            return False
+
+        evicted = self.top_k.push(score, TopKEntry(row, modified_comparator, coverage, self.current_dat_file))
+        for mc in modified_comparator:
+            self.increment_seed_density(mc)
+
+        if evicted is not None:
+            trace_logger.debug('modified comparator %s evicted from the top %s', evicted.tokens, self.top_k.k)
+            for mc in evicted.tokens:
+                self.decrement_seed_density(mc)
+            self.skipped_rows += 1
+            self.run_stats.evict(evicted.dat_file)
+
+        classifier_logger.info('TOP K on comparator %s with novelty %s', comparator, score)
         self.build_seed_stats()
+        self.run_stats.accept()
+        self.run_stats.add_time('accept', time.time() - t0)
         return True
 
+    def rescore_top_k(self):
+        """
+        re-runs the density check on the narratives held in self.top_k against the current seed, evicting those which
+        now fail it, then re-scores the rest. both leave out each narrative's own tokens. the other checks of
+        check_narrative only look at the seed items and already_checked, which a held narrative cannot start failing
+        """
+        seed_density = self.seed_density
+
+        failed = []
+        for entry in self.top_k.entries():
+            comparator = entry.row[pos_TRANS_NARR]  # the output row starts with the parsed columns
+            tokens = comparator.strip().split(' ')
+            own_counts = entry.token_counts()
+            densities = [density - own_counts.get(token, 0)
+                         for token, density in zip(tokens, seed_density.lookup(tokens))]
+            if self.fails_density_check(comparator, tokens, densities):
+                failed.append(entry)
+
+        if failed:
+            self.top_k.remove(failed)
+            for entry in failed:
+                trace_logger.debug('modified comparator %s evicted from the top %s, now failing the density check',
+                                   entry.tokens, self.top_k.k)
+                for mc in entry.tokens:
+                    self.decrement_seed_density(mc)
+                self.density_fail.add(entry.row[pos_TRANS_NARR])
+                self.skipped_rows += 1
+                self.run_stats.evict(entry.dat_file, 'top_k_density_fail')
+            self.build_seed_stats()
+
+        self.top_k.rescore(lambda entry: novelty_score(entry.tokens, seed_density, entry.coverage,
+                                                       entry.token_counts()))
+
+
+
+    def process_file(self, position, dat_file, start_row=0):
+        """
+        parses, filters and writes one ranked file, in blocks of self.prefilter_chunk_size input rows.
+        accepted rows go to self.writer, which buffers them, so memory stays flat
+
+        args:
+            position(int): index of dat_file in self.ranked_files, for checkpoints
+            dat_file(str): full path to the data file
+            start_row(int): rows of dat_file already processed, before the checkpoint being resumed from or before
+                            the file was moved back for low yield
+        """
+        row_ctr = start_row
+        blocks = self.iter_filtered_blocks(dat_file, start_row)
+
+        yield_monitor = self.yield_monitor
+        if yield_monitor is not None:
+            yield_monitor.start_file(dat_file, self.seed_stats['upper_threshold'], start_row,
+                                     self.ranked_files[position].get('requeued', False))
+            skipped_rows = self.skipped_rows
+            action = None
+
+        for block_rows, accepted in blocks:
+            row_ctr += block_rows
+            self.rows_since_checkpoint += block_rows
+
+            write_start = time.time()
+            self.writer.write_rows(accepted)
+            self.run_stats.add_time('write', time.time() - write_start)
+
+            if yield_monitor is not None:
+                # rows not skipped, so top-K offers held in the heap count as accepted too
+                action = yield_monitor.update(block_rows, block_rows - (self.skipped_rows - skipped_rows),
+                                              self.seed_stats['upper_threshold'])
+                skipped_rows = self.skipped_rows
+                if action is not None:
+                    blocks.close()  # closes the file, or stops its prefetch worker
+                    if action == 'requeue':
+                        self.ranked_files.append(dict(self.ranked_files[position], start_row=row_ctr, requeued=True))
+                    break
+
+            if self.checkpoint_every and self.rows_since_checkpoint >= self.checkpoint_every:
+                self.save_checkpoint(position, row_ctr)
+
+        if yield_monitor is not None and action is None:
+            yield_monitor.end_file()
+
+        # with a background writer this overlaps with parsing the next file
+        self.writer.flush()
+
+    def iter_filtered_blocks(self, dat_file, start_row=0):
+        """
+        yields (number of input rows, accepted rows) for each block of self.prefilter_chunk_size input rows of dat_file
+
+        args:
+            dat_file(str): full path to the data file
+            start_row(int): rows of dat_file to pass over first
+        """
+        row_ctr = start_row
 
-    def get_comparator_coverage_for_seed_list_item(self, item, comparator):
-        item_tokens = item.strip().split(' ')
+        for block in chunked(self.iter_xsv_rows(dat_file, start_row), self.prefilter_chunk_size):
+            accepted = list(self.filter_rows(block, row_ctr))
+            row_ctr += len(block)
+            yield len(block), accepted
 
-        item_tokens_in_comparator = [i for i in item_tokens if i in comparator]
+    def save_checkpoint(self, position, row_ctr):
+        """
+        saves the engine state needed to carry on from row row_ctr of self.ranked_files[position]
 
-        try:
-            r = float(len(item_tokens_in_comparator)) / len(item_tokens)
-            return r
-        except ZeroDivisionError, e:
-            classifier_logger.debug('zero division error on seed list item %s'%item)
+        args:
+            position(int): index into self.ranked_files
+            row_ctr(int): rows of that file already processed
+        """
+        # everything accepted so far has to be on disk before the checkpoint records the outfile size
+        outfile_size = self.writer.sync()
+
+        state = {'data_file_path': self.data_file_path,
+                 'ranked_files': self.ranked_files,
+                 'position': position,
+                 'row_ctr': row_ctr,
+                 'writer': self.writer.state(),
+                 'outfile_size': outfile_size,
+                 'known_files': self.known_files,
+                 'processed_rows': self.processed_rows,
+                 'skipped_rows': self.skipped_rows,
+                 'seed': self.seed,
+                 'seed_index': self.seed_index,
+                 'seed_density': self.seed_density,
+                 'already_checked': self.already_checked,
+                 'density_fail': self.density_fail,
+                 'near_duplicates': self.near_duplicates,
+                 'top_k': self.top_k,
+                 'yield_stopped': self.yield_monitor.stopped if self.yield_monitor is not None else [],
+                 'run_stats': self.run_stats}
+
+        if save_checkpoint(self.checkpoint_file, state):
+            main_logger.info('checkpoint saved at file %s row %s' % (position, row_ctr))
+        self.rows_since_checkpoint = 0
+
+    def restore_checkpoint(self):
+        """
+        restores the engine state from self.checkpoint_file so get_files carries on where the checkpoint was taken.
+        the state includes the seed, so nothing is loaded from the seed snapshot or .seed files
+
+        returns:
+            restored(bool): False if there is no usable checkpoint for this data_file_path
+        """
+        state = load_checkpoint(self.checkpoint_file)
+        if state is None:
             return False
 
+        if state['data_file_path'] != self.data_file_path:
+            main_logger.warning('checkpoint %s is for %s, not %s - starting afresh' % (
+                self.checkpoint_file, state['data_file_path'], self.data_file_path))
+            return False
+
+        self.ranked_files = state['ranked_files']
+        self.known_files = state['known_files']
+        self.resume_position = (state['position'], state['row_ctr'])
+        self.resuming = True
+        self.processed_rows = state['processed_rows']
+        self.skipped_rows = state['skipped_rows']
+        self.already_checked = state['already_checked']
+        self.density_fail = state['density_fail']
+        self.near_duplicates = state['near_duplicates']
+        self.top_k = state['top_k']
+        self.run_stats = state['run_stats']
+        if self.yield_monitor is not None:
+            self.yield_monitor.stopped = state['yield_stopped']
+
+        self.seed = state['seed']
+        self.seed_index = state['seed_index']
+        self.seed_density = state['seed_density']
+        self.token_ids = self.seed_density.dictionary  # a superset of the one self.seed_index was built with
+        self.seed_density_stats = SeedDensityStats(self.seed_density.itervalues())
+        self.seed_stats = {}
+        self.build_seed_stats()
+
+        # drop anything written after the checkpoint
+        self.writer.restore(state['writer'], state['outfile_size'])
+        self.outfile = self.writer.outfile
+        self.outfile_ctr = self.writer.outfile_ctr
+
+        main_logger.info('resuming from checkpoint at file %s of %s, row %s' % (
+            state['position'], len(self.ranked_files), state['row_ctr']))
+        return True
 
     def set_outfile(self):
-        # get outfile
-        outfile = self.outfile
-        outfileLoc = os.path.join(current_path(), outfile)
-        incl_headers = False
+        """
+        moves self.writer on to the next input file, rotating the outfile once it is over its size limit.
+        the size is tracked by the writer, so this makes no stat calls
 
-        try:
-            outfile_size = os.stat(outfileLoc).st_size
-        except:
-            # this is the first time thru
-            iologger.info('creating first outfile')
-            outfile_size = 0
-            incl_headers = True
-
-        if outfile_size > 2000000:
-            self.outfile_ctr += 1
-            iologger.info('rotating outfile to %s' % self.outfile_ctr)
-            self.outfile = outfile.split('.')[0] + str(self.outfile_ctr) + '.out'
-            incl_headers = True
+        returns:
+            (outfile, incl_headers)
+        """
+        self.outfile, incl_headers = self.writer.next_input_file()
+        self.outfile_ctr = self.writer.outfile_ctr
 
         return self.outfile, incl_headers
 
     def write_pipe_delimited(self, write_file, rows_to_write, headings=False):
-
-        if headings is False:
-            out_file = csv.writer(open(write_file, 'a'), delimiter="|")
-
-        if headings is True:
-            out_file = csv.writer(open(write_file, 'w'), delimiter="|")
-            try:
-                out_file.writerow(rows_to_write[0])
-            except IOError, e:
-                iologger(e)
-                iologger(self.current_dat_file)
-                return False
+        """
+        writes a table in one go, outside of self.writer. rows_to_write[0] is the headings row,
+        written only if headings is True (which also replaces any existing write_file)
+        """
 
         try:
-            out_file.writerows(rows_to_write[1:])
+            with open(write_file, 'w' if headings is True else 'a') as fileHandle:
+                out_file = csv.writer(fileHandle, delimiter="|")
+                if headings is True:
+                    out_file.writerow(rows_to_write[0])
+                out_file.writerows(rows_to_write[1:])
         except IOError, e:
-            iologger(e)
-            iologger(self.current_dat_file)
+            iologger.error(e)
+            iologger.error(self.current_dat_file)
             return False
 
         return True
 
-    def rank_files(self):
-        # todo: scan file for correct date range
-        # add method invoked from the __init__ which:
-        # parses thru all the datafiles in reverse size order, and
-        # builds list of lists such as:
+    def rank_files(self, dat_files=None):
+        # scores each data file and sorts them descending on the score, so the most useful files are processed first
+        # dat_files: None ranks every file matching self.data_file_path into self.ranked_files; otherwise the given
+        # files, eg new arrivals in watch mode, are ranked among themselves and queued after self.ranked_files
+        # rank_by 'dates': the score is the count of re_date_search matches
+        # rank_by 'compound': builds for each file
         # [filename, count of date match, count of re_bad_narratives instances, count of self.seed['t_desc_clean'] instances, figure for comparison]
-        # where "figure for comparison" is compounded from the 3 previous values
-        # the list of lists should then be sorted descending based on "figure for comparison"; and
-        # the normal process should resume
-        main_logger.info('running rank_files')
+        # where "figure for comparison" is compounded from the 3 previous values - see file_scorer.compound_score
+        # rank_by 'sample': the estimated number of rows in the file passing the cheap checks, from a sample of its
+        # blocks - see file_sampler.py
+        main_logger.info('running rank_files by %s with %s worker(s)' % (self.rank_by, self.workers))
         outer_list = []
 
-        for c, dat_file in enumerate(glob.iglob(self.data_file_path)):
-            if c % 100 == 0: stream_logger.info('%s\t%s'%(c, len(outer_list)))
-
-            m1 = 0.
-            m2 = 0.
-            inner_list = {'dat_file':dat_file}
-
-            size = os.stat(dat_file).st_size
-            f = open(dat_file)
-            data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
-            f.close()
+        ranking_all = dat_files is None
+        if ranking_all:
+            dat_files = glob_data_files(self.data_file_path)  # including .gz / .bz2 / .xz versions
+        file_stats = [os.stat(dat_file) for dat_file in dat_files]
+
+        if self.rank_by == 'compound':
+            # date, bad narrative and seed phrase counts from a single pass over each file
+            file_scorer = FileScorer(self.seed['t_desc_clean'], idx_TRANS_NARR, self.delimiter)
+            signature = pattern_signature(*file_scorer.signature())
+            scorer, initializer, initargs = score_file_with_scorer, init_file_scorer, (file_scorer,)
+        elif self.rank_by == 'sample':
+            # estimated rows passing the cheap checks, from a few blocks of each file
+            file_scorer = FileSampler(self.row_parser, count_passing_rows, self.seed['t_desc_clean'],
+                                      blocks=self.rank_sample_blocks, block_bytes=self.rank_sample_bytes)
+            signature = pattern_signature(*file_scorer.signature())
+            scorer, initializer, initargs = score_file_with_scorer, init_file_scorer, (file_scorer,)
+        else:
+            signature = pattern_signature(re_date_search)
+            scorer, initializer, initargs = score_file, None, ()
+
+        cache = None
+        if self.rank_cache:
+            cache = RankCache(os.path.join(self.fileloc, RANK_CACHE_FILENAME), signature)
+            cached = [cache.get(dat_file, st) for dat_file, st in zip(dat_files, file_stats)]
+        else:
+            cached = [MISSING] * len(dat_files)
+
+        # only new or changed files are scanned
+        to_scan = [dat_file for dat_file, inner_list in zip(dat_files, cached) if inner_list is MISSING]
+        pool = None
+
+        if self.workers > 1 and len(to_scan) > 1:
+            # the initializer hands the FileScorer to each worker once, rather than with every file
+            pool = multiprocessing.Pool(self.workers, initializer, initargs)
+            # imap keeps glob order, so files with equal scores rank the same as a single process run
+            scores = pool.imap(scorer, to_scan, chunksize=8)
+        else:
+            if initializer is not None:
+                initializer(*initargs)
+            scores = itertools.imap(scorer, to_scan)
 
-            m1 += len(re.findall(re_date_search, data))
-            # data.seek(0)
-            data.close()
+        try:
+            for c, dat_file in enumerate(dat_files):
+                if c % 100 == 0: stream_logger.info('%s\t%s'%(c, len(outer_list)))
 
-            if m1 != 0:
-                pass
-            #     m2 = len(re_bad_narratives.findall(data))
-            #     # m2 = len(re.findall(re_bad_narratives, data))
-            else:
-                continue
-            # m2 += max(1,m2)
+                inner_list = cached[c]
+                if inner_list is MISSING:
+                    inner_list = next(scores)
+                    if cache is not None:
+                        cache.put(dat_file, file_stats[c], inner_list)
 
-            inner_list.update({'date_match':m1})
-            # inner_list.update({'bad_narr_match':m2})
+                if inner_list is None:
+                    continue
 
-            # too slow!!!
-            # m3 = 0
-            # for re_seed_as_a_list in self.re_seed_as_a_list:
-            #     m3 += len(re.findall(re_seed_as_a_list, data))
+                outer_list.append(inner_list)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
-            # inner_list.update({'seed_match':m3})
-            inner_list.update({'score': m1})
-            # inner_list.update({'score': m1/m2})
-            outer_list.append(inner_list)
+        if cache is not None:
+            cache.save(prune=ranking_all)  # ranking some files only adds their scores to the cache
 
         outer_list = sorted(outer_list, key=lambda x:x['score'], reverse=True)
-        self.ranked_files = outer_list
+        if ranking_all:
+            self.ranked_files = outer_list
+            self.known_files = list(dat_files)
+        else:
+            self.ranked_files.extend(outer_list)
+            self.known_files.extend(dat_files)
         main_logger.info('finished rank_files')
         pass
 
@@ -520,35 +1355,71 @@ class DiffEngine(object):
 
     def get_files(self):
 
-        # for c, dat_file in enumerate(glob.iglob(self.data_file_path)):
-        for c, ranked_entry in enumerate(self.ranked_files):
-
-            dat_file = ranked_entry['dat_file']
-            score_ = ranked_entry['score']
-
-            main_logger.info('running %s with score %s' % (dat_file, score_))
+        if self.shards > 1:
+            self.process_shards()
+        else:
+            self.process_ranked_files()
 
-            out = self.set_outfile()
+        self.finish_files()
 
-            self.current_dat_file = dat_file  # used for logging
+    def finish_files(self):
+        """
+        writes out what is left once every ranked file is processed and logs the final stats
+        """
+        self.current_dat_file = None #reinitialise
+        if self.top_k is not None:
+            self.writer.write_rows([entry.row for entry in self.top_k.drain()])
+        self.writer.sync()
 
-            dat = self.xsvParser(dat_file)
+        if self.checkpoint_every or self.watch_mode:
+            self.save_checkpoint(len(self.ranked_files), 0)
 
-            main_logger.debug('parse complete, starting write')
-            # dat = self.clean_dat(dat)
-            # logger.info('clean complete, starting write')
-            if len(dat) > 1:
-                self.write_pipe_delimited(out[0], dat, out[1])
-            main_logger.debug('clean complete, write complete')
-            main_logger.info("after current file: %s processed; %s skipped; %s" % (self.processed_rows,
+        main_logger.info("completed with %s processed; %s skipped; %s" % (self.processed_rows,
                                                                 self.skipped_rows,
-                                                                str(1. - (float(self.skipped_rows)/self.processed_rows))))
+                                                                str(1. - (float(self.skipped_rows)/max(1, self.processed_rows)))))
+
+        memory_stats = {'membership': self.membership,
+                        'already_checked_items': len(self.already_checked),
+                        'already_checked_bytes': membership_nbytes(self.already_checked),
+                        'density_fail_items': len(self.density_fail),
+                        'density_fail_bytes': membership_nbytes(self.density_fail),
+                        'token_ids': len(self.token_ids) - 1,
+                        'seed_density_bytes': self.seed_density.nbytes(),
+                        'seed_index_bytes': self.seed_index.nbytes(),
+                        'peak_rss_kb': peak_rss_kb()}
+        main_logger.info("memory: %(membership)s membership; already_checked %(already_checked_items)s items in "
+                         "%(already_checked_bytes)s bytes; density_fail %(density_fail_items)s items in "
+                         "%(density_fail_bytes)s bytes; %(token_ids)s token ids; seed densities in "
+                         "%(seed_density_bytes)s bytes; seed index in %(seed_index_bytes)s bytes; "
+                         "peak rss %(peak_rss_kb)s KB" % memory_stats)
+        final_stats.info('MEMORY')
+        for k, v in sorted(memory_stats.items()):
+            final_stats.info("%s\t%s"%(k, v))
 
-        self.current_dat_file = None #reinitialise
+        if self.yield_monitor is not None:
+            # where each file stopped early was left off, to revisit
+            final_stats.info('STOPPED FILES')
+            for stopped in self.yield_monitor.stopped:
+                final_stats.info("%(dat_file)s\t%(row)s\t%(action)s\t%(acceptance_rate)s" % stopped)
+            self.run_stats.stopped_files = self.yield_monitor.stopped
+
+        if self.run_stats_file:
+            self.run_stats.write(self.run_stats_file)
+
+        # where the time went, with 'pick' broken down by check - see run_stats.PICK_STAGES
+        stage_seconds = self.run_stats.totals()['seconds']
+        main_logger.info("stage seconds: %s" % '; '.join('%s %.3f' % (stage, stage_seconds[stage]) for stage in STAGES))
+        final_stats.info('STAGE SECONDS')
+        for stage in STAGES:
+            final_stats.info("%s\t%s"%(stage, stage_seconds[stage]))
+
+        token_cache_stats = self.token_cache.stats()
+        main_logger.info("token cache: %(hits)s hits; %(misses)s misses; %(evictions)s evictions in %(clears)s clears; "
+                         "%(size)s of %(max_size)s tokens cached" % token_cache_stats)
+        final_stats.info('TOKEN CACHE')
+        for k, v in sorted(token_cache_stats.items()):
+            final_stats.info("%s\t%s"%(k, v))
 
-        main_logger.info("completed with %s processed; %s skipped; %s" % (self.processed_rows,
-                                                                self.skipped_rows,
-                                                                str(1. - (float(self.skipped_rows)/self.processed_rows))))
         final_stats.info('DENSITIES')
 
         for k,v in self.seed_stats.items():
@@ -557,6 +1428,146 @@ class DiffEngine(object):
         for k, v in sorted(self.seed_density.items(),key=lambda x: x[0]):
             final_stats.info("%s\t%s"%(k, v))
 
+    def process_ranked_files(self):
+        """
+        processes self.ranked_files one after another, from self.resume_position on
+        """
+        start_position, start_row = self.resume_position
+
+        if self.decompress_workers:
+            self.prefetcher = Prefetcher([r['dat_file'] for r in self.ranked_files[start_position:]],
+                                         workers=self.decompress_workers)
+
+        try:
+            # for c, dat_file in enumerate(glob.iglob(self.data_file_path)):
+            for c, ranked_entry in enumerate(self.ranked_files):
+
+                if c < start_position:
+                    continue  # done before the checkpoint we resumed from
+
+                dat_file = ranked_entry['dat_file']
+                score_ = ranked_entry['score']
+
+                main_logger.info('running %s with score %s' % (dat_file, score_))
+
+                if c == start_position and self.resuming:
+                    self.resuming = False  # the writer state restored from the checkpoint already covers this file
+                else:
+                    self.set_outfile()
+                    start_row = ranked_entry.get('start_row', 0)  # past 0 for a file moved back for low yield
+
+                self.current_dat_file = dat_file  # used for logging
+                self.run_stats.start_file(dat_file)
+                file_start = time.time()
+
+                self.process_file(c, dat_file, start_row)
+                if self.top_k is not None:
+                    self.rescore_top_k()  # the seed has moved on since the earlier narratives were scored
+
+                self.run_stats.add_time('file', time.time() - file_start)
+                self.run_stats.end_file()
+                main_logger.debug('parse, clean and write complete')
+                main_logger.info("after current file: %s processed; %s skipped; %s" % (self.processed_rows,
+                                                                    self.skipped_rows,
+                                                                    str(1. - (float(self.skipped_rows)/self.processed_rows))))
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+                self.prefetcher = None
+
+    def watch(self):
+        """
+        watch mode: processes the ranked files, then keeps the engine warm and processes the new data files matching
+        self.data_file_path as they land, until SIGTERM or SIGINT, or watch_idle_exit seconds without a new file.
+
+        new files are ranked among themselves as each poll finds them and queued after the files already processed.
+        the engine state is flushed to self.checkpoint_file every watch_flush_seconds while there is anything new,
+        and on stopping, so a restarted watch resumes from it warm rather than loading and ranking afresh
+        """
+        stop = []
+
+        def request_stop(signum, frame):
+            # only acted on between polls, so the engine state is never flushed half way through a file
+            main_logger.info('signal %s received, stopping once the files being processed are done' % signum)
+            stop.append(signum)
+
+        handlers = dict((signum, signal.signal(signum, request_stop)) for signum in (signal.SIGTERM, signal.SIGINT))
+        # files rank_files dropped for having no dates are known too, so they are not scored again
+        watcher = DirectoryWatcher(self.data_file_path,
+                                   self.known_files + [ranked_entry['dat_file'] for ranked_entry in self.ranked_files])
+        main_logger.info('watching %s every %s seconds' % (self.data_file_path, self.watch_poll_seconds))
+
+        try:
+            self.process_ranked_files()
+            self.resuming = False  # a resume position at the end of the ranked files is never reached
+            last_new = last_flush = time.time()
+            unflushed = False
+
+            while not stop:
+                new_files = watcher.poll()
+                if new_files:
+                    position = len(self.ranked_files)
+                    self.rank_files(new_files)
+                    self.resume_position = (position, 0)
+                    self.process_ranked_files()
+                    self.writer.sync()  # so each file's rows are on disk once it is processed
+                    last_new = time.time()
+                    unflushed = True
+
+                if unflushed and time.time() - last_flush >= self.watch_flush_seconds:
+                    self.save_checkpoint(len(self.ranked_files), 0)
+                    last_flush = time.time()
+                    unflushed = False
+
+                if self.watch_idle_exit and time.time() - last_new >= self.watch_idle_exit:
+                    main_logger.info('no new data files for %s seconds, stopping' % self.watch_idle_exit)
+                    break
+
+                if not stop and not new_files:
+                    time.sleep(self.watch_poll_seconds)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        self.finish_files()
+
+    def process_shards(self):
+        """
+        processes self.ranked_files in self.shards worker processes - see shards.py. the drift report goes into
+        the run stats, and with shard_drift_check the accepted narratives are compared with a sequential run
+        """
+        coordinator = ShardCoordinator(self, self.shards, self.shard_sync_rows, keep_accepted=self.shard_drift_check)
+        coordinator.run()
+        report = coordinator.report()
+
+        if self.shard_drift_check:
+            report.update(compare_accepted(coordinator.accepted, self.run_sequential_reference()))
+
+        main_logger.info('shard drift: %s' % report)
+        final_stats.info('SHARDS')
+        for k, v in sorted(report.items()):
+            final_stats.info("%s\t%s"%(k, v))
+        self.run_stats.shards = report
+
+    def run_sequential_reference(self):
+        """
+        runs the same files sequentially, writing to a temporary folder, for the shard drift check
+
+        returns:
+            accepted(set): the comparators accepted by the sequential run
+        """
+        main_logger.info('running sequentially for the shard drift check')
+        reference_dir = tempfile.mkdtemp(prefix='diffengine_reference_')
+        try:
+            reference = DiffEngine(**dict(self.kwargs, shards=1, shard_drift_check=False, run_stats=None,
+                                          outfile=os.path.join(reference_dir, 'reference0.out')))
+            reference.accept_log = []
+            reference.get_files()
+        finally:
+            shutil.rmtree(reference_dir, ignore_errors=True)
+
+        return set(comparator for comparator, modified_comparator in reference.accept_log)
+
 
 if __name__ == '__main__':
 
@@ -576,6 +1587,153 @@ if __name__ == '__main__':
                         help='output file naming convention; defaults to out/outfile0.out',
                         default='out/outfile0.out')
 
+    parser.add_argument('-w', '--workers', required=False, type=int,
+                        help='number of processes used to rank the data files; defaults to 1',
+                        default=1)
+
+    parser.add_argument('--no-rank-cache', dest='rank_cache', action='store_false',
+                        help='rescan every data file instead of reusing scores cached in %s' % RANK_CACHE_FILENAME)
+
+    parser.add_argument('--rank-by', dest='rank_by', required=False, choices=RANK_MODES, default='dates',
+                        help="how data files are ranked: 'dates' on date matches only, 'compound' also on bad "
+                             "narratives and seed phrase hits, 'sample' on the estimated rows passing the cheap "
+                             "checks, from a sample of each file; defaults to dates")
+
+    parser.add_argument('--rank-sample-blocks', dest='rank_sample_blocks', required=False, type=int,
+                        help='blocks read from each data file for --rank-by sample; defaults to %s' % SAMPLE_BLOCKS,
+                        default=SAMPLE_BLOCKS)
+
+    parser.add_argument('--rank-sample-bytes', dest='rank_sample_bytes', required=False, type=int,
+                        help='bytes per block for --rank-by sample; defaults to %s' % SAMPLE_BLOCK_BYTES,
+                        default=SAMPLE_BLOCK_BYTES)
+
+    parser.add_argument('-m', '--membership', required=False, choices=MEMBERSHIP_MODES,
+                        help='how already checked narratives are remembered: exact strings, 64 bit hashes or a '
+                             'bloom filter; defaults to exact',
+                        default='exact')
+
+    parser.add_argument('--bloom-capacity', dest='bloom_capacity', required=False, type=int,
+                        help='expected number of narratives for --membership bloom; defaults to %s' % BLOOM_CAPACITY,
+                        default=BLOOM_CAPACITY)
+
+    parser.add_argument('--bloom-error-rate', dest='bloom_error_rate', required=False, type=float,
+                        help='false positive rate for --membership bloom; defaults to %s' % BLOOM_ERROR_RATE,
+                        default=BLOOM_ERROR_RATE)
+
+    parser.add_argument('--near-duplicates', dest='near_duplicates', action='store_true',
+                        help='also reject narratives close to a seed item or accepted row on character shingles')
+
+    parser.add_argument('--near-dup-threshold', dest='near_dup_threshold', required=False, type=float,
+                        help='shingle similarity at which a narrative is a near duplicate; '
+                             'defaults to %s' % NEAR_DUP_THRESHOLD,
+                        default=NEAR_DUP_THRESHOLD)
+
+    parser.add_argument('--near-dup-bands', dest='near_dup_bands', required=False, type=int,
+                        help='LSH bands; more finds more near duplicates but is slower; '
+                             'defaults to %s' % NEAR_DUP_BANDS,
+                        default=NEAR_DUP_BANDS)
+
+    parser.add_argument('--near-dup-rows', dest='near_dup_rows', required=False, type=int,
+                        help='MinHash values per LSH band; more is faster but finds fewer; '
+                             'defaults to %s' % NEAR_DUP_ROWS,
+                        default=NEAR_DUP_ROWS)
+
+    parser.add_argument('--shingle-size', dest='shingle_size', required=False, type=int,
+                        help='characters per shingle for --near-duplicates; defaults to %s' % SHINGLE_SIZE,
+                        default=SHINGLE_SIZE)
+
+    parser.add_argument('-k', '--top-k', dest='top_k', required=False, type=int, default=0,
+                        help='write only the K most novel narratives of the whole run, instead of every narrative '
+                             'passing the checks as it is found; defaults to 0, off')
+
+    parser.add_argument('--shards', required=False, type=int, default=1,
+                        help='number of worker processes to split the ranked files over; defaults to 1')
+
+    parser.add_argument('--shard-sync-rows', dest='shard_sync_rows', required=False, type=int,
+                        help='input rows each shard processes between seed merges; defaults to %s' % SHARD_SYNC_ROWS,
+                        default=SHARD_SYNC_ROWS)
+
+    parser.add_argument('--shard-drift-check', dest='shard_drift_check', action='store_true',
+                        help='after a sharded run, also run sequentially and report the difference')
+
+    parser.add_argument('--yield-policy', dest='yield_policy', required=False, choices=YIELD_POLICIES, default='off',
+                        help="what to do with a file whose acceptance rate falls below --yield-floor: 'abandon' "
+                             "passes over the rest of it, 'requeue' moves the rest to the back of the queue while "
+                             "the seed thresholds are still moving; defaults to off, reading every file to the end")
+
+    parser.add_argument('--yield-floor', dest='yield_floor', required=False, type=float,
+                        help='acceptance rate below which a file is low-yield; defaults to %s' % YIELD_FLOOR,
+                        default=YIELD_FLOOR)
+
+    parser.add_argument('--yield-min-rows', dest='yield_min_rows', required=False, type=int,
+                        help='rows of a file read before it can be stopped for low yield; '
+                             'defaults to %s' % YIELD_MIN_ROWS,
+                        default=YIELD_MIN_ROWS)
+
+    parser.add_argument('--yield-window', dest='yield_window', required=False, type=int,
+                        help='input rows the acceptance rate and threshold change are taken over; '
+                             'defaults to %s' % YIELD_WINDOW,
+                        default=YIELD_WINDOW)
+
+    parser.add_argument('--yield-settle-rate', dest='yield_settle_rate', required=False, type=float,
+                        help='relative change of the seed upper threshold over the window below which the seed counts '
+                             'as settled; defaults to %s' % SETTLE_RATE,
+                        default=SETTLE_RATE)
+
+    parser.add_argument('--run-stats', dest='run_stats', required=False,
+                        help='where the per-file stage timings and reject counts are written as JSON; '
+                             'defaults to logs/run_stats.json',
+                        default='logs/run_stats.json')
+
+    parser.add_argument('--async-logging', dest='async_logging', action='store_true',
+                        help='write log files from a background thread')
+
+    parser.add_argument('--trace-sample-rate', dest='trace_sample_rate', required=False, type=float,
+                        help='fraction of the per-token classifier trace lines to log; defaults to 1.0',
+                        default=1.0)
+
+    parser.add_argument('--checkpoint-every', dest='checkpoint_every', required=False, type=int,
+                        help='save a checkpoint every N input rows; defaults to 0 (no checkpoints)',
+                        default=0)
+
+    parser.add_argument('--checkpoint', required=False,
+                        help='checkpoint file; defaults to out/%s' % CHECKPOINT_FILENAME,
+                        default=os.path.join(current_path(), 'out', CHECKPOINT_FILENAME))
+
+    parser.add_argument('--resume', action='store_true',
+                        help='carry on from the last checkpoint instead of starting afresh')
+
+    parser.add_argument('--background-write', dest='background_write', action='store_true',
+                        help='write output from a background thread, overlapping with parsing')
+
+    parser.add_argument('--gzip-output', dest='gzip_output', action='store_true',
+                        help='gzip each output file')
+
+    parser.add_argument('--decompress-workers', dest='decompress_workers', required=False, type=int, default=0,
+                        help='processes decompressing the next compressed data files ahead of the one being '
+                             'processed; defaults to 0, reading each compressed file as it comes')
+
+    parser.add_argument('--compile-seed', dest='compile_seed', action='store_true',
+                        help='compile the .seed files to %s and exit' % SEED_SNAPSHOT_FILENAME)
+
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running after the ranked files, processing new data files as they land in fileloc; '
+                             'resumes from the checkpoint if there is one')
+
+    parser.add_argument('--watch-poll-seconds', dest='watch_poll_seconds', required=False, type=float,
+                        help='seconds between polls for new data files; defaults to %s' % WATCH_POLL_SECONDS,
+                        default=WATCH_POLL_SECONDS)
+
+    parser.add_argument('--watch-flush-seconds', dest='watch_flush_seconds', required=False, type=float,
+                        help='seconds between flushes of the engine state to the checkpoint; '
+                             'defaults to %s' % WATCH_FLUSH_SECONDS,
+                        default=WATCH_FLUSH_SECONDS)
+
+    parser.add_argument('--watch-idle-exit', dest='watch_idle_exit', required=False, type=float,
+                        help='stop watching after this many seconds without a new data file; '
+                             'defaults to 0, watching until stopped',
+                        default=0)
+
     args = parser.parse_args()
 
     kwargs = vars(args)
@@ -591,4 +1749,8 @@ if __name__ == '__main__':
     print 'args', vars(args)
 
     worker = DiffEngine(**kwargs)
-    worker.get_files()
+
+    if args.watch and not args.compile_seed:
+        worker.watch()
+    elif not args.compile_seed:
+        worker.get_files()
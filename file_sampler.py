@@ -0,0 +1,194 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Sample based file scorer for the 'sample' ranking in the rank_files method of the DiffEngine class in extract.py
+
+rank_files only uses the scores to order the files, so reading every byte of every file is more than it needs.
+FileSampler reads a fixed number of line-aligned blocks from each file instead, and estimates how many of the
+file's rows would get past the cheap checks:
+    - an uncompressed file is cut into `blocks` equal slices and one block is read from a random offset in each.
+      the offsets are drawn from a generator seeded on the file name and size, so a file gets the same sample,
+      and score, on every run
+    - a compressed file cannot be sought, so its blocks are taken from the start of the stream, across as many gzip
+      members or bz2 / xz streams as it takes. the compressed bytes read give the compression ratio, from which the
+      decompressed size is estimated
+    - the rows of the sample are parsed and run through the row checks passed in (see extract.count_passing_rows),
+      which gives the share of the rows reaching the density checks
+
+The score is the estimated number of rows passing: the estimated rows in the file times the pass rate. Dates are
+counted on the sample as well, and scaled up to the file. The cost of scoring a file depends on the number and size
+of the blocks, not on the size of the file. A file no bigger than the sample is read whole, and scored exactly.
+"""
+
+import os
+import re
+import bz2
+import zlib
+import random
+import hashlib
+import cStringIO
+
+from regex_filters import re_date_search, re_bad_narratives, re_dead_narratives
+from compressed_input import lzma, open_data_file
+
+# defaults: blocks read from each file, and bytes per block
+SAMPLE_BLOCKS = 8
+SAMPLE_BLOCK_BYTES = 1 << 16
+
+# compressed bytes fed to a decompressor at a time
+_CHUNK_BYTES = 1 << 14
+
+# compressed bytes read from a file at most, as a multiple of the sample size, however little they decompress to
+_MAX_COMPRESSED_RATIO = 2
+
+# extension -> new decompressor object, for reading the start of a compressed file while counting the bytes used
+DECOMPRESSORS = {'.gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                 '.bz2': bz2.BZ2Decompressor}
+if lzma is not None:
+    DECOMPRESSORS['.xz'] = lzma.LZMADecompressor
+
+
+class FileSampler(object):
+    """
+    scores data files on a sample of their rows
+
+    args:
+        row_parser(RowParser): parses the sampled lines, as the engine does
+        row_checks(callable): row_checks(rows, seed_items) returns how many of the parsed rows pass the cheap checks
+        seed_items(set): cleaned seed narratives, for the easy checks
+        blocks(int): blocks read from each file
+        block_bytes(int): bytes per block
+        random_seed(int): seed for the block offsets, combined with each file's name and size
+    """
+    def __init__(self, row_parser, row_checks, seed_items, blocks=SAMPLE_BLOCKS, block_bytes=SAMPLE_BLOCK_BYTES,
+                 random_seed=0):
+        self.row_parser = row_parser
+        self.row_checks = row_checks
+        self.seed_items = seed_items
+        self.blocks = blocks
+        self.block_bytes = block_bytes
+        self.random_seed = random_seed
+        self.date_search = re.compile(re_date_search)
+
+        md5 = hashlib.md5()
+        for seed_item in sorted(seed_items):
+            md5.update(seed_item)
+            md5.update('\0')
+        self.seed_digest = md5.hexdigest()
+
+    def signature(self):
+        """
+        identifies what the scores depend on, for the rank cache
+        """
+        return (re_date_search, re_bad_narratives.pattern, re_dead_narratives.pattern, 'sample', str(self.blocks),
+                str(self.block_bytes), str(self.random_seed), self.seed_digest)
+
+    def read_sample(self, dat_file):
+        """
+        returns:
+            (sample, estimated_bytes, whole): the sampled lines as one string, the estimated (decompressed) size of
+            the file and whether the sample is the whole file
+        """
+        size = os.stat(dat_file).st_size
+        extension = os.path.splitext(dat_file)[1].lower()
+
+        if extension in DECOMPRESSORS:
+            return self._read_compressed(dat_file, size, DECOMPRESSORS[extension])
+
+        if extension == '.xz':
+            # no lzma module, so no way of counting the compressed bytes used - sampled as if uncompressed
+            with open_data_file(dat_file) as fileHandle:
+                data = fileHandle.read(self.blocks * self.block_bytes + 1)
+            if len(data) <= self.blocks * self.block_bytes:
+                return data, len(data), True
+            return data[:data.rfind('\n') + 1], size, False
+
+        if size <= self.blocks * self.block_bytes:
+            with open(dat_file, 'rb') as fileHandle:
+                return fileHandle.read(), size, True
+
+        rnd = random.Random(zlib.crc32('%s:%s' % (os.path.basename(dat_file), size)) ^ self.random_seed)
+        stride = size // self.blocks
+        parts = []
+        with open(dat_file, 'rb') as fileHandle:
+            for block in xrange(self.blocks):
+                offset = block * stride + rnd.randint(0, max(0, stride - self.block_bytes))
+                # read from the byte before the offset, so a line starting right at the offset is kept
+                start = max(0, offset - 1)
+                fileHandle.seek(start)
+                data = fileHandle.read(self.block_bytes + offset - start)
+                if start > 0:
+                    data = data[data.find('\n') + 1:] if '\n' in data else ''
+                parts.append(data[:data.rfind('\n') + 1])
+
+        return ''.join(parts), size, False
+
+    def _read_compressed(self, dat_file, size, new_decompressor):
+        # a file can hold several gzip members or bz2 / xz streams one after another, as open_data_file reads it, so
+        # a new decompressor carries on from the unused data of each one that ends
+        wanted = self.blocks * self.block_bytes
+        parts = []
+        decompressed = 0
+        compressed = 0
+        whole = False
+        decompressor = new_decompressor()
+
+        with open(dat_file, 'rb') as fileHandle:
+            while decompressed < wanted and compressed < _MAX_COMPRESSED_RATIO * wanted:
+                chunk = fileHandle.read(_CHUNK_BYTES)
+                if not chunk:
+                    whole = True
+                    break
+                compressed += len(chunk)
+                try:
+                    try:
+                        data = decompressor.decompress(chunk)
+                    except EOFError:
+                        # the last chunk ended exactly at the end of a bz2 / xz stream
+                        decompressor = new_decompressor()
+                        data = decompressor.decompress(chunk)
+
+                    while getattr(decompressor, 'unused_data', ''):
+                        unused_data = decompressor.unused_data
+                        decompressor = new_decompressor()
+                        data += decompressor.decompress(unused_data)
+                except (EOFError, IOError, zlib.error):
+                    break  # not compressed data, eg padding after the last member; what was read so far is the sample
+
+                parts.append(data)
+                decompressed += len(data)
+
+        data = ''.join(parts)
+        if whole:
+            return data, len(data), True
+
+        estimated_bytes = size * float(decompressed) / compressed if compressed else 0
+        return data[:data.rfind('\n') + 1], estimated_bytes, False
+
+    def score(self, dat_file):
+        """
+        returns:
+            inner_list(dict) = {'dat_file':..., 'sampled_rows':..., 'rows':..., 'date_match':..., 'pass_rate':...,
+                                'score':...} or None if the file is empty, or was read whole and has no date matches
+        """
+        sample, estimated_bytes, whole = self.read_sample(dat_file)
+        if not sample:
+            return None
+
+        lines = list(cStringIO.StringIO(sample))
+        date_match = len(self.date_search.findall(sample))
+        if whole and date_match == 0:
+            return None
+
+        passing = self.row_checks(list(self.row_parser.parse_lines(lines)), self.seed_items)
+
+        scale = float(estimated_bytes) / len(sample)
+        pass_rate = float(passing) / len(lines)
+        rows = len(lines) * scale
+
+        return {'dat_file': dat_file,
+                'sampled_rows': len(lines),
+                'rows': int(round(rows)),
+                'date_match': int(round(date_match * scale)),
+                'pass_rate': pass_rate,
+                'score': rows * pass_rate}
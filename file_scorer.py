@@ -0,0 +1,172 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Single pass file scorer for the compound ranking in the rank_files method of the DiffEngine class in extract.py
+
+Each data file is read once, in line-aligned blocks, and three counts are taken from every block:
+    date_match      - re_date_search matches anywhere in the block, as the plain date ranking counts them
+    bad_narr_match  - narratives matching re_bad_narratives or re_dead_narratives
+    seed_match      - seed phrases (self.seed['t_desc_clean']) found in the narratives
+
+Seed phrases are found with an Aho-Corasick automaton over narrative tokens, so every phrase is matched in a single
+walk over each narrative instead of one regex pass over the file per seed chunk. Phrases only match on whole tokens.
+"""
+
+import re
+import mmap
+import hashlib
+import collections
+
+from regex_filters import re_date_search, re_bad_narratives, re_dead_narratives
+from compressed_input import is_compressed, open_data_file, iter_blocks
+
+# how rank_files can score a file: 'dates' counts re_date_search matches only; 'compound' uses compound_score;
+# 'sample' estimates the rows passing the cheap checks from a sample of the file - see file_sampler.py
+RANK_MODES = ('dates', 'compound', 'sample')
+
+
+def compound_score(counts):
+    """
+    the date matches of a file, discounted by the share of its narratives that are bad and boosted by the number of
+    seed phrase hits per narrative
+    """
+    narratives = max(1, counts['narratives'])
+
+    return (counts['date_match'] * (1. - float(counts['bad_narr_match']) / narratives)
+            * (1. + float(counts['seed_match']) / narratives))
+
+
+class PhraseAutomaton(object):
+    """
+    Aho-Corasick automaton over tokens rather than characters. count() returns how many phrases occur in a list of
+    tokens, overlapping occurrences included
+
+    args:
+        phrases(iterable): space separated phrases, eg the cleaned seed narratives
+    """
+    def __init__(self, phrases):
+        self.goto = [{}]  # state -> {token: next state}
+        self.fail = [0]   # state -> longest proper suffix state
+        self.out = [0]    # state -> number of phrases ending at this state or any of its suffix states
+        self.phrases = 0
+
+        for phrase in set(tuple(phrase.split()) for phrase in phrases):
+            if phrase:
+                self._add(phrase)
+
+        self._build_fail_links()
+
+    def _add(self, tokens):
+        state = 0
+        for token in tokens:
+            next_state = self.goto[state].get(token)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][token] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(0)
+            state = next_state
+
+        self.out[state] += 1
+        self.phrases += 1
+
+    def _build_fail_links(self):
+        queue = collections.deque(self.goto[0].itervalues())  # depth 1 states fail back to the root
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self.goto[state].iteritems():
+                queue.append(next_state)
+
+                fail = self.fail[state]
+                while fail and token not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(token, 0)
+                self.out[next_state] += self.out[self.fail[next_state]]
+
+    def count(self, tokens):
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        matches = 0
+        for token in tokens:
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            matches += out[state]
+
+        return matches
+
+
+class FileScorer(object):
+    """
+    takes the date, bad narrative and seed phrase counts of a data file in one pass
+
+    args:
+        phrases(iterable): seed phrases to count
+        narrative_index(int): field of the narrative in each row, eg idx_TRANS_NARR
+        delimiter(str): field delimiter
+    """
+    def __init__(self, phrases, narrative_index, delimiter='|'):
+        phrases = sorted(set(phrases))
+        self.automaton = PhraseAutomaton(phrases)
+        self.date_search = re.compile(re_date_search)
+        # the narrative field of each complete enough line, pulled out of a block in one findall
+        d = re.escape(delimiter)
+        self.narrative_search = re.compile(r'^(?:[^%s\n]*%s){%d}([^%s\n]*)' % (d, d, narrative_index, d), re.M)
+
+        md5 = hashlib.md5()
+        for phrase in phrases:
+            md5.update(phrase)
+            md5.update('\0')
+        self.phrase_digest = md5.hexdigest()
+
+    def signature(self):
+        """
+        identifies what the scores depend on, for the rank cache
+        """
+        return (re_date_search, re_bad_narratives.pattern, re_dead_narratives.pattern, 'compound', self.phrase_digest)
+
+    def score_blocks(self, blocks):
+        counts = {'date_match': 0, 'bad_narr_match': 0, 'seed_match': 0, 'narratives': 0}
+        for block in blocks:
+            counts['date_match'] += len(self.date_search.findall(block))
+
+            for narr in self.narrative_search.findall(block):
+                tokens = narr.split()
+                counts['narratives'] += 1
+                narr = ' '.join(tokens)
+                if re_bad_narratives.match(narr) or re_dead_narratives.match(narr):
+                    counts['bad_narr_match'] += 1
+                    continue
+                counts['seed_match'] += self.automaton.count(tokens)
+
+        return counts
+
+    def score(self, dat_file):
+        """
+        returns:
+            inner_list(dict) = {'dat_file':..., 'date_match':..., 'bad_narr_match':..., 'seed_match':...,
+                                'narratives':..., 'score':...} or None if no dates match
+        """
+        if is_compressed(dat_file):
+            with open_data_file(dat_file) as f:
+                counts = self.score_blocks(iter_blocks(f))
+        else:
+            with open(dat_file) as f:
+                try:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    return None  # mmap cannot map an empty file
+            try:
+                counts = self.score_blocks(iter_blocks(data))
+            finally:
+                data.close()
+
+        if counts['date_match'] == 0:
+            return None
+
+        inner_list = {'dat_file': dat_file}
+        inner_list.update(counts)
+        inner_list['score'] = compound_score(counts)
+
+        return inner_list
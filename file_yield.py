@@ -0,0 +1,156 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Early stopping of low-yield data files for the DiffEngine class in the extract.py module
+
+Files are ranked before a row of them is read, so a file can rank high and still stop giving accepted rows once the
+seed has taken in what it has to offer. YieldMonitor follows the current file block by block, over its last `window`
+input rows:
+    - the acceptance rate: rows accepted per input row
+    - the threshold change: how far seed_stats['upper_threshold'] moved, relative to its current value
+
+Once min_rows of the file have been read, the file is low-yield when its acceptance rate falls below floor. What
+happens to it depends on the policy:
+    - 'abandon': the rest of the file is passed over
+    - 'requeue': while the threshold change is above settle_rate the seed is still moving, and the file may give
+      more rows against a different seed, so the rest of it is moved to the back of the queue. a file already moved
+      back once, or low-yield once the seed has settled, is abandoned
+
+Every file stopped early is logged with the row it stopped at, and listed under 'stopped_files' in the run stats,
+so the rest of it can be revisited. A file moved back is listed until its queued rest is read: it is dropped from
+the list once read to the end, or listed again at the row it was abandoned at.
+"""
+
+import math
+import collections
+
+from loggers import main_logger
+
+# what to do with low-yield files: 'off' reads every file to the end
+YIELD_POLICIES = ('off', 'abandon', 'requeue')
+
+# defaults: acceptance rate below which a file is low-yield, rows read before a file can be stopped, rows the rates
+# are taken over, and relative threshold change below which the seed counts as settled
+YIELD_FLOOR = 0.001
+YIELD_MIN_ROWS = 20000
+YIELD_WINDOW = 20000
+SETTLE_RATE = 0.01
+
+
+def _finite(x):
+    return not (math.isnan(x) or math.isinf(x))
+
+
+class YieldMonitor(object):
+    """
+    decides, block by block, whether the current file is still worth reading
+
+    args:
+        policy(str): one of YIELD_POLICIES other than 'off'
+        floor(float): acceptance rate below which a file is low-yield
+        min_rows(int): rows of a file read before it can be stopped
+        window(int): input rows the acceptance rate and threshold change are taken over
+        settle_rate(float): threshold change below which the seed counts as settled
+    """
+    def __init__(self, policy='abandon', floor=YIELD_FLOOR, min_rows=YIELD_MIN_ROWS, window=YIELD_WINDOW,
+                 settle_rate=SETTLE_RATE):
+        self.policy = policy
+        self.floor = floor
+        self.min_rows = min_rows
+        self.window = window
+        self.settle_rate = settle_rate
+
+        self.stopped = []  # one dict per file stopped early, in the order they were stopped
+        self.start_file(None, 0., 0)
+
+    def start_file(self, dat_file, threshold, start_row=0, requeued=False):
+        """
+        args:
+            dat_file(str): the file about to be read
+            threshold(float): seed_stats['upper_threshold'] before its first block
+            start_row(int): rows of the file passed over, eg when it was moved back
+            requeued(bool): whether the file was moved back before
+        """
+        self.dat_file = dat_file
+        self.requeued = requeued
+        self.row = start_row
+        self.rows = 0
+        self.threshold = threshold
+
+        self.blocks = collections.deque()  # (rows, accepted, threshold before the block) over the window
+        self.window_rows = 0
+        self.window_accepted = 0
+
+    def end_file(self):
+        """
+        the current file was read to the end, so nothing of it is left to revisit
+        """
+        if self.requeued:
+            self._forget_requeued()
+
+    def _forget_requeued(self):
+        self.stopped = [stopped for stopped in self.stopped
+                        if not (stopped['dat_file'] == self.dat_file and stopped['action'] == 'requeue')]
+
+    def acceptance_rate(self):
+        return float(self.window_accepted) / self.window_rows if self.window_rows else 1.
+
+    def threshold_change(self):
+        start = self.blocks[0][2] if self.blocks else self.threshold
+        if not (_finite(self.threshold) and _finite(start)):
+            return float('inf')  # no usable thresholds yet, so the seed has not settled
+        if self.threshold == 0:
+            return 0. if start == 0 else float('inf')
+        return abs(self.threshold - start) / abs(self.threshold)
+
+    def update(self, block_rows, accepted, threshold):
+        """
+        records a block of the current file
+
+        args:
+            block_rows(int): input rows in the block
+            accepted(int): rows of the block accepted
+            threshold(float): seed_stats['upper_threshold'] after the block
+
+        returns:
+            None to carry on with the file, otherwise 'abandon' or 'requeue'
+        """
+        self.blocks.append((block_rows, accepted, self.threshold))
+        self.threshold = threshold
+        self.row += block_rows
+        self.rows += block_rows
+        self.window_rows += block_rows
+        self.window_accepted += accepted
+
+        # keep at least window rows, dropping the oldest blocks beyond that
+        while len(self.blocks) > 1 and self.window_rows - self.blocks[0][0] >= self.window:
+            rows, accepted_, threshold_ = self.blocks.popleft()
+            self.window_rows -= rows
+            self.window_accepted -= accepted_
+
+        if self.rows < self.min_rows:
+            return None
+
+        acceptance_rate = self.acceptance_rate()
+        if acceptance_rate >= self.floor:
+            return None
+
+        threshold_change = self.threshold_change()
+        if self.policy == 'requeue' and not self.requeued and threshold_change > self.settle_rate:
+            action = 'requeue'
+        else:
+            action = 'abandon'
+
+        if self.requeued:
+            self._forget_requeued()  # superseded by where it stops now
+        self.stopped.append({'dat_file': self.dat_file,
+                             'row': self.row,
+                             'rows_read': self.rows,
+                             'acceptance_rate': acceptance_rate,
+                             'threshold_change': threshold_change if _finite(threshold_change) else None,
+                             'action': action})
+        main_logger.info('%s %s at row %s: acceptance rate %s over the last %s rows, threshold change %s' % (
+            'moving back' if action == 'requeue' else 'abandoning', self.dat_file, self.row, acceptance_rate,
+            self.window_rows, threshold_change))
+
+        return action
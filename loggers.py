@@ -4,8 +4,11 @@ __author__ = 'Ammar Akhtar'
 This file creates loggers for the DiffEngine class in the extract.py module
 """
 
+import atexit
 import logging
 import logging.handlers
+import threading
+import Queue
 
 # set up logs
 LOG_FILENAME = 'logs/logs.out'
@@ -48,4 +51,167 @@ classifier_logger.addHandler(classifierhandler)
 final_stats = logging.getLogger('final_stats')
 final_stats.setLevel(logging.INFO)
 final_stats.addHandler(final_stats_handler)
-# end set up logs
\ No newline at end of file
+
+
+class SamplingLogger(logging.Logger):
+    """
+    logger passing a deterministic fraction of its calls: with rate 0.1 every 10th call gets through
+
+    the sample is rolled in isEnabledFor, which debug(), info() etc. check first, so a call sampled out returns before
+    the caller is looked up or a record is created. a logging.Filter only runs once both are done, which costs far
+    more than the per-token checks the trace lines describe
+    """
+    def __init__(self, name, rate=1.0):
+        logging.Logger.__init__(self, name)
+        self.rate = rate
+        self.seen = 0
+
+    def isEnabledFor(self, level):
+        if not logging.Logger.isEnabledFor(self, level):
+            return False
+        if self.rate >= 1.0:
+            return True
+
+        self.seen += 1
+        return int(self.seen * self.rate) > int((self.seen - 1) * self.rate)
+
+
+# per-token and per-comparator trace lines from the classifier. these go to the classifier_logger handlers,
+# thinned out by their sample rate - see set_trace_sample_rate(). made directly rather than through getLogger, which
+# would make a plain Logger, so the parent is set by hand
+trace_logger = SamplingLogger('classifier_logger.trace')
+trace_logger.parent = classifier_logger
+# end set up logs
+
+
+def set_trace_sample_rate(rate):
+    """
+    sets the fraction of trace_logger calls which are written; 1.0 writes all of them, 0 none
+    """
+    trace_logger.rate = rate
+    # at 0 raise the level so trace calls return without even counting towards the sample
+    trace_logger.setLevel(logging.CRITICAL + 1 if rate <= 0 else logging.NOTSET)
+
+
+class QueueHandler(logging.Handler):
+    """
+    hands records to a queue for a QueueListener to write. records are not formatted here, so the calling
+    thread only pays for creating the record - message formatting happens on the listener thread
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+        try:
+            self.queue.put(record)
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """
+    thread taking records off a queue and passing each to the handlers of the logger it was logged against
+    """
+    _sentinel = None
+
+    def __init__(self, queue, handlers_by_logger):
+        self.queue = queue
+        self.handlers_by_logger = handlers_by_logger
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._monitor, name='log_listener')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+
+            for handler in self.handlers_by_logger[record.logger_name]:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(self._sentinel)
+            self.thread.join()
+            self.thread = None
+
+
+class _LoggerQueueHandler(QueueHandler):
+    # tags each record with the logger whose handlers it should go to
+    def __init__(self, queue, logger_name):
+        QueueHandler.__init__(self, queue)
+        self.logger_name = logger_name
+
+    def emit(self, record):
+        record.logger_name = self.logger_name
+        QueueHandler.emit(self, record)
+
+
+_listener = None
+
+
+def start_async_logging(loggers=(main_logger, iologger, classifier_logger, final_stats), maxsize=100000):
+    """
+    moves the handlers of the given loggers behind a queue, written by a single listener thread, so logging calls
+    return without waiting for formatting, file writes or rotation. the queue is flushed at exit or on
+    stop_async_logging(). a full queue blocks the caller rather than dropping records
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    queue = Queue.Queue(maxsize)
+    handlers_by_logger = {}
+
+    for logger in loggers:
+        handlers_by_logger[logger.name] = logger.handlers[:]
+        for handler in handlers_by_logger[logger.name]:
+            logger.removeHandler(handler)
+        logger.addHandler(_LoggerQueueHandler(queue, logger.name))
+
+    _listener = QueueListener(queue, handlers_by_logger)
+    _listener.start()
+    atexit.register(stop_async_logging)
+
+    return _listener
+
+
+def stop_async_logging():
+    """
+    writes out anything still queued and puts the original handlers back on their loggers
+    """
+    if _listener is None:
+        return
+
+    _listener.stop()
+    _restore_handlers()
+
+
+def after_fork():
+    """
+    for a process forked while async logging was on: the listener thread is not carried over by the fork, so put
+    the original handlers back and log directly. records still queued in the parent are left to the parent
+    """
+    if _listener is None:
+        return
+
+    _restore_handlers()
+
+
+def _restore_handlers():
+    global _listener
+    for name, handlers in _listener.handlers_by_logger.items():
+        logger = logging.getLogger(name)
+        for handler in logger.handlers[:]:
+            if isinstance(handler, _LoggerQueueHandler):
+                logger.removeHandler(handler)
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    _listener = None
\ No newline at end of file
@@ -0,0 +1,108 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Compact alternatives to the plain sets the DiffEngine class in the extract.py module uses to remember
+narratives it has already seen (already_checked, density_fail)
+
+- 'exact': a set of the narratives themselves, as before
+- 'hash':  a set of 64 bit digests of the narratives. distinct narratives collide with a probability of
+           about n^2 / 2^65, so this is exact for any practical run while never holding the narratives
+- 'bloom': a bloom filter sized for an expected number of narratives and a false positive rate. memory is
+           fixed up front; a false positive means a genuinely new narrative is treated as already checked
+"""
+
+import sys
+import math
+import struct
+import hashlib
+
+MEMBERSHIP_MODES = ('exact', 'hash', 'bloom')
+
+# defaults for the bloom filter
+BLOOM_CAPACITY = 10000000
+BLOOM_ERROR_RATE = 0.001
+
+
+def digest64(item):
+    return struct.unpack('<q', hashlib.md5(item).digest()[:8])[0]
+
+
+class HashedSet(object):
+    """
+    set-like membership test holding a 64 bit digest of each item rather than the item
+    """
+    def __init__(self):
+        self.digests = set()
+
+    def add(self, item):
+        self.digests.add(digest64(item))
+
+    def __contains__(self, item):
+        return digest64(item) in self.digests
+
+    def __len__(self):
+        return len(self.digests)
+
+    def nbytes(self):
+        return sys.getsizeof(self.digests) + sum(sys.getsizeof(d) for d in self.digests)
+
+
+class BloomFilter(object):
+    """
+    bloom filter sized for capacity items at error_rate false positives, using double hashing over an md5 digest
+
+    len() is the number of add() calls, not the number of distinct items
+    """
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(item).digest())
+        return [(h1 + i * h2) % self.num_bits for i in xrange(self.num_hashes)]
+
+    def add(self, item):
+        for p in self.positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for p in self.positions(item):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return sys.getsizeof(self.bits)
+
+
+def new_membership_set(mode='exact', capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+    """
+    returns an empty set-like object supporting add() and 'in' for the given mode - see MEMBERSHIP_MODES
+    """
+    if mode == 'exact':
+        return set()
+    if mode == 'hash':
+        return HashedSet()
+    if mode == 'bloom':
+        return BloomFilter(capacity, error_rate)
+
+    raise ValueError('unknown membership mode %s, expected one of %s' % (mode, ', '.join(MEMBERSHIP_MODES)))
+
+
+def membership_nbytes(members):
+    """
+    approximate memory held by a membership set, including its items
+    """
+    if isinstance(members, set):
+        return sys.getsizeof(members) + sum(sys.getsizeof(m) for m in members)
+
+    return members.nbytes()
@@ -0,0 +1,186 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Approximate near-duplicate lookup for the DiffEngine class in the extract.py module
+
+The coverage check in pick_or_reject_narrative only compares whole tokens, so narratives differing by a typo, a
+concatenation or a reference number inside a token are treated as new. This index compares narratives on character
+shingles instead:
+    - a narrative is normalised (whitespace dropped, digit runs replaced by '#') and cut into shingles of
+      shingle_size characters
+    - a MinHash signature of bands x rows values estimates the Jaccard similarity of two shingle sets
+    - the signature is split into bands; narratives sharing any band land in the same bucket and become candidates
+    - candidates are confirmed on the exact Jaccard similarity of their shingles against threshold
+
+Lookups only touch the buckets of the narrative's own bands, so they do not grow with the number of items indexed.
+Recall is tuned with bands and rows - a pair with similarity s becomes a candidate with probability
+1 - (1 - s^rows)^bands - and precision with threshold. Signatures are not kept; the shingle set of each indexed
+narrative is, so confirming a candidate is one set intersection rather than re-shingling it on every lookup.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+# defaults: with 20 bands of 5 rows a pair at the 0.7 threshold is a candidate about 97% of the time
+NEAR_DUP_THRESHOLD = 0.7
+NEAR_DUP_BANDS = 20
+NEAR_DUP_ROWS = 5
+SHINGLE_SIZE = 3
+
+# items signed at a time by add_many. each batch holds a bands x rows x (shingles in the batch) uint64 array
+SIGN_BATCH_SIZE = 2000
+
+re_digits = re.compile(r'\d+')
+re_whitespace = re.compile(r'\s+')
+
+
+def shingles(narrative, shingle_size=SHINGLE_SIZE):
+    """
+    returns the set of character shingles of narrative, after dropping whitespace and collapsing digit runs to '#'
+    """
+    text = re_digits.sub('#', re_whitespace.sub('', narrative))
+    if len(text) <= shingle_size:
+        return set([text]) if text else set()
+
+    return set(text[i:i + shingle_size] for i in xrange(len(text) - shingle_size + 1))
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.
+
+    return len(a & b) / float(len(a | b))
+
+
+class NearDuplicateIndex(object):
+    """
+    MinHash / LSH index over the character shingles of narratives
+
+    args:
+        threshold(float): shingle Jaccard similarity at or above which a narrative counts as a near duplicate
+        bands(int): LSH bands; more bands means more candidates, so better recall and slower lookups
+        rows(int): signature values per band; more rows means fewer, closer candidates
+        shingle_size(int): characters per shingle
+        random_seed(int): seed for the MinHash permutations
+    """
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD, bands=NEAR_DUP_BANDS, rows=NEAR_DUP_ROWS,
+                 shingle_size=SHINGLE_SIZE, random_seed=0):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.shingle_size = shingle_size
+
+        # multiply-shift hashes (a * x + b) >> 32 over 64 bit words, one per each of the bands x rows values
+        rnd = np.random.RandomState(random_seed)
+        self.a = self._random_words(rnd, (bands * rows, 1)) | np.uint64(1)
+        self.b = self._random_words(rnd, (bands * rows, 1))
+        # folds the rows of each band into one 64 bit bucket key. keys colliding only add a candidate which then
+        # fails the Jaccard check
+        self.band_mix = self._random_words(rnd, (1, rows, 1)) | np.uint64(1)
+
+        self.items = []  # item id -> narrative
+        self.shingle_sets = []  # item id -> frozenset of its shingles, for the Jaccard check of find
+        # per band: bucket key -> item id, or a list of item ids once a second item shares the bucket. most buckets
+        # hold a single item, so this saves a list for each of them
+        self.buckets = [{} for _ in xrange(bands)]
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def _random_words(rnd, shape):
+        high = rnd.randint(0, 1 << 32, size=shape).astype(np.uint64)
+        low = rnd.randint(0, 1 << 32, size=shape).astype(np.uint64)
+
+        return (high << np.uint64(32)) | low
+
+    def _hash_shingles(self, shingle_set):
+        return [zlib.crc32(s) & 0xffffffff for s in shingle_set]
+
+    def _signatures(self, hashes, offsets):
+        # minhash over the concatenated shingle hashes of several items; column i is the signature of the item whose
+        # hashes start at offsets[i]
+        x = np.array(hashes, dtype=np.uint64)
+        permuted = (self.a * x + self.b) >> np.uint64(32)  # the products wrap around at 2^64
+
+        return np.minimum.reduceat(permuted, offsets, axis=1)
+
+    def _band_keys(self, signatures):
+        # one list of per band bucket keys for each signature column
+        banded = signatures.reshape(self.bands, self.rows, -1)
+
+        return (banded * self.band_mix).sum(axis=1).T.tolist()
+
+    def _insert(self, narrative, shingle_set, band_keys):
+        item_id = len(self.items)
+        self.items.append(narrative)
+        self.shingle_sets.append(frozenset(shingle_set))
+        for bucket, key in zip(self.buckets, band_keys):
+            ids = bucket.get(key)
+            if ids is None:
+                bucket[key] = item_id
+            elif type(ids) is list:
+                ids.append(item_id)
+            else:
+                bucket[key] = [ids, item_id]
+
+    def add(self, narrative):
+        self._add_batch([narrative])
+
+    def add_many(self, narratives):
+        """
+        indexes narratives, signing them SIGN_BATCH_SIZE at a time in one numpy pass per batch
+        """
+        batch = []
+        for narrative in narratives:
+            batch.append(narrative)
+            if len(batch) >= SIGN_BATCH_SIZE:
+                self._add_batch(batch)
+                batch = []
+        if batch:
+            self._add_batch(batch)
+
+    def _add_batch(self, batch):
+        hashes = []
+        offsets = []
+        signed = []
+        for narrative in batch:
+            shingle_set = shingles(narrative, self.shingle_size)
+            if not shingle_set:
+                continue
+            offsets.append(len(hashes))
+            hashes.extend(self._hash_shingles(shingle_set))
+            signed.append((narrative, shingle_set))
+
+        if not signed:
+            return
+
+        for (narrative, shingle_set), band_keys in zip(signed, self._band_keys(self._signatures(hashes, offsets))):
+            self._insert(narrative, shingle_set, band_keys)
+
+    def find(self, narrative):
+        """
+        returns an indexed narrative with shingle similarity to narrative of at least self.threshold, or None
+        """
+        shingle_set = shingles(narrative, self.shingle_size)
+        if not shingle_set:
+            return None
+
+        band_keys = self._band_keys(self._signatures(self._hash_shingles(shingle_set), [0]))[0]
+
+        checked = set()
+        for bucket, key in zip(self.buckets, band_keys):
+            ids = bucket.get(key)
+            if ids is None:
+                continue
+            for item_id in (ids if type(ids) is list else (ids,)):
+                if item_id in checked:
+                    continue
+                checked.add(item_id)
+
+                if jaccard(shingle_set, self.shingle_sets[item_id]) >= self.threshold:
+                    return self.items[item_id]
+
+        return None
@@ -0,0 +1,241 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Buffered, rotating writer for the output files of the DiffEngine class in the extract.py module
+
+Accepted rows are encoded into an in-memory buffer and written out in large blocks to a file handle which stays open
+between input files. The number of bytes written to the current output file is tracked in memory, so deciding whether
+to rotate needs no stat calls. Blocks can optionally be written by a background thread, so writing one input file's
+rows overlaps with parsing the next, and each output file can optionally be gzipped.
+
+Rotation follows the original set_outfile rules: the size is checked when a new input file starts, and once the
+current output file is over rotate_bytes, the output moves on to <name><counter>.out with the headings written again.
+"""
+
+import os
+import csv
+import gzip
+import threading
+import Queue
+import cStringIO
+
+from loggers import iologger
+
+# output files are rotated once they are bigger than this
+ROTATE_BYTES = 2000000
+
+# accepted rows are buffered until they encode to at least this many bytes
+WRITE_BUFFER_BYTES = 1 << 20
+
+
+class _BackgroundFileWriter(object):
+    """
+    thread doing the actual file writes, in the order they were queued
+    """
+    def __init__(self, maxsize=8):
+        self.queue = Queue.Queue(maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='output_writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                if func is None:
+                    return
+                if self.error is None:
+                    func(*args)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def submit(self, func, *args):
+        self.raise_error()
+        self.queue.put((func, args))
+
+    def wait(self):
+        self.queue.join()
+        self.raise_error()
+
+    def stop(self):
+        self.queue.put((None, ()))
+        self.thread.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+class OutputWriter(object):
+    """
+    args:
+        outfile(str): path of the first output file, eg out/outfile0.out
+        headings(list): row written at the top of every output file
+        rotate_bytes(int): size after which the next input file goes to a new output file
+        buffer_bytes(int): encoded bytes buffered before a block is written
+        background(bool): write blocks from a background thread
+        compress(bool): gzip each output file, adding .gz to its name
+        delimiter(str): field delimiter
+    """
+    def __init__(self, outfile, headings, rotate_bytes=ROTATE_BYTES, buffer_bytes=WRITE_BUFFER_BYTES,
+                 background=False, compress=False, delimiter='|'):
+        self.outfile = outfile
+        self.headings = headings
+        self.rotate_bytes = rotate_bytes
+        self.buffer_bytes = buffer_bytes
+        self.compress = compress
+        self.delimiter = delimiter
+        self.outfile_ctr = 0
+        self.mode = 'a'  # mode the next block is written with; 'w' once for each new outfile
+
+        self.file_handle = None
+        self.file_path = None  # path file_handle is open on
+        self._new_buffer()
+
+        # as per the original set_outfile: carry on appending to an existing outfile, without headings
+        path = self.path()
+        if os.path.exists(path):
+            self.bytes_written = os.path.getsize(path)
+            self.headings_pending = False
+        else:
+            iologger.info('creating first outfile')
+            self.bytes_written = 0
+            self.headings_pending = True
+
+        self.background = _BackgroundFileWriter() if background else None
+
+    def path(self):
+        return self.outfile + '.gz' if self.compress else self.outfile
+
+    def _new_buffer(self):
+        self.buffer = cStringIO.StringIO()
+        self.csv_writer = csv.writer(self.buffer, delimiter=self.delimiter)
+
+    def next_input_file(self):
+        """
+        called as each input file starts; rotates the outfile once it is bigger than rotate_bytes
+
+        returns:
+            (outfile, headings) - headings is True while the current outfile has no headings written yet
+        """
+        if self.bytes_written > self.rotate_bytes:
+            self.flush()
+            self.outfile_ctr += 1
+            iologger.info('rotating outfile to %s' % self.outfile_ctr)
+            dir_name, base_name = os.path.split(self.outfile)
+            self.outfile = os.path.join(dir_name, base_name.split('.')[0] + str(self.outfile_ctr) + '.out')
+            self.bytes_written = 0
+            self.headings_pending = True
+
+        return self.outfile, self.headings_pending
+
+    def write_rows(self, rows):
+        """
+        buffers rows for the current outfile, after the headings if they have not been written yet
+        """
+        if not rows:
+            return
+
+        start = self.buffer.tell()
+        if self.headings_pending:
+            self.csv_writer.writerow(self.headings)
+            self.headings_pending = False
+            self.mode = 'w'  # a new outfile replaces anything already at its path
+        self.csv_writer.writerows(rows)
+        self.bytes_written += self.buffer.tell() - start
+
+        if self.buffer.tell() >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self, wait=False):
+        """
+        writes out the buffered rows. with a background writer, wait=True blocks until they are on disk
+        """
+        data = self.buffer.getvalue()
+        if data:
+            self._new_buffer()
+            mode, self.mode = self.mode, 'a'
+            self._submit(self._write, self.path(), mode, data)
+
+        if wait and self.background is not None:
+            self.background.wait()
+
+    def sync(self):
+        """
+        writes out everything buffered and closes the file handle, so the outfile on disk is complete - for a gzip
+        outfile this also ends the current gzip member. the next write reopens the file for appending
+
+        returns:
+            size(int): size of the current outfile on disk
+        """
+        self.flush()
+        self._submit(self._close)
+        if self.background is not None:
+            self.background.wait()
+
+        path = self.path()
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def close(self):
+        self.sync()
+        if self.background is not None:
+            self.background.stop()
+            self.background = None
+
+    def state(self):
+        """
+        returns what is needed to restore the writer, eg from a checkpoint. call sync() first
+        """
+        return {'outfile': self.outfile, 'outfile_ctr': self.outfile_ctr, 'bytes_written': self.bytes_written,
+                'headings_pending': self.headings_pending}
+
+    def restore(self, state, disk_size):
+        """
+        restores the writer to state, cutting its outfile back to disk_size to drop anything written since
+        """
+        self.sync()
+        self.outfile = state['outfile']
+        self.outfile_ctr = state['outfile_ctr']
+        self.bytes_written = state['bytes_written']
+        self.headings_pending = state['headings_pending']
+
+        path = self.path()
+        if os.path.exists(path):
+            with open(path, 'r+b') as fileHandle:
+                fileHandle.truncate(disk_size)
+
+    def _submit(self, func, *args):
+        if self.background is not None:
+            self.background.submit(func, *args)
+        else:
+            func(*args)
+
+    # the methods below run on the background thread when there is one
+
+    def _write(self, path, mode, data):
+        if self.file_handle is not None and (self.file_path != path or mode == 'w'):
+            self._close()
+
+        try:
+            if self.file_handle is None:
+                if self.compress:
+                    self.file_handle = gzip.open(path, mode + 'b')
+                else:
+                    self.file_handle = open(path, mode + 'b')
+                self.file_path = path
+
+            self.file_handle.write(data)
+        except IOError as e:
+            iologger.error('could not write %s: %s' % (path, e))
+            raise
+
+    def _close(self):
+        if self.file_handle is not None:
+            self.file_handle.close()
+            self.file_handle = None
+            self.file_path = None
@@ -0,0 +1,108 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Persistent cache of rank_files scores for the DiffEngine class in the extract.py module
+
+Scores are kept in a sidecar file in the data directory, keyed by file path, size and mtime. The whole cache is
+tagged with a signature of the regex used to score the files, so it is discarded when that regex changes.
+"""
+
+import os
+import json
+import hashlib
+
+from loggers import main_logger
+
+RANK_CACHE_FILENAME = '.diffengine_rank_cache'
+
+# returned by RankCache.get when the file has to be (re)scanned; None is a valid cached result
+MISSING = object()
+
+
+def pattern_signature(*patterns):
+    """
+    returns a hex digest of the given regex patterns, so cached results can be tied to the regex that produced them
+    """
+    md5 = hashlib.md5()
+    for pattern in patterns:
+        md5.update(getattr(pattern, 'pattern', pattern))
+        md5.update('\0')
+
+    return md5.hexdigest()
+
+
+class RankCache(object):
+    """
+    maps an absolute file path to [size, mtime, result], where result is the score_file output minus
+    'dat_file' - or None for files that had no date matches
+
+    save() writes back only the files looked up during this run, so deleted files drop out of the cache - unless
+    prune is False, eg when only some of the files were ranked, when they are merged into the entries loaded
+    """
+    def __init__(self, cache_file, signature):
+        self.cache_file = cache_file
+        self.signature = signature
+        self.entries = {}
+        self.seen = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r') as fileHandle:
+                cached = json.load(fileHandle)
+        except (IOError, ValueError) as e:
+            main_logger.info('no usable rank cache at %s: %s' % (self.cache_file, e))
+            return
+
+        if cached.get('signature') != self.signature:
+            main_logger.info('rank cache signature changed, rescanning all files')
+            return
+
+        self.entries = cached.get('entries', {})
+
+    def get(self, dat_file, st):
+        key = os.path.abspath(dat_file)
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime:
+            self.misses += 1
+            return MISSING
+
+        self.hits += 1
+        self.seen[key] = entry
+
+        if entry[2] is None:
+            return None
+
+        inner_list = {'dat_file': dat_file}
+        inner_list.update(entry[2])
+        return inner_list
+
+    def put(self, dat_file, st, inner_list):
+        result = None
+        if inner_list is not None:
+            result = dict((k, v) for k, v in inner_list.items() if k != 'dat_file')
+
+        self.seen[os.path.abspath(dat_file)] = [st.st_size, st.st_mtime, result]
+
+    def save(self, prune=True):
+        if prune:
+            entries = self.seen
+        else:
+            entries = dict(self.entries)
+            entries.update(self.seen)
+
+        tmp_file = self.cache_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as fileHandle:
+                json.dump({'signature': self.signature, 'entries': entries}, fileHandle)
+            os.rename(tmp_file, self.cache_file)
+        except (IOError, OSError) as e:
+            main_logger.warning('could not write rank cache %s: %s' % (self.cache_file, e))
+            return False
+
+        main_logger.info('rank cache saved: %s hits, %s misses' % (self.hits, self.misses))
+        return True
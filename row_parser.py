@@ -0,0 +1,65 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Projecting parser for the delimited data files read by the DiffEngine class in the extract.py module
+
+Only the columns the engine uses are stripped and kept in the parsed rows, in the order it asks for them. Each line
+is split in C with str.split, at most n_fields times: the fields past the file layout stay in one unsplit remainder
+and never become separate strings, and the unused fields within it are dropped without being stripped.
+
+Rows match what the old split-and-strip parser gave for the kept columns:
+    - '|?' is read as '|' (a quirk of the dataset this was written for)
+    - no quoting: quote characters are part of the field
+    - a line with fewer than n_fields fields is returned as an empty row, which the engine counts as misaligned
+
+The csv module was tried for the splitting as well, but it splits every field of the line and was slower than
+str.split on narrow rows - see benchmark.py --wide.
+"""
+
+import operator
+import itertools
+
+
+class RowParser(object):
+    """
+    args:
+        n_fields(int): number of fields a line needs to be aligned, eg len(HEADERS)
+        columns(list): indices of the fields to keep, in the order parsed rows hold them
+        delimiter(str): field delimiter
+        fix_quirk(bool): read '|?' as '|'
+    """
+    def __init__(self, n_fields, columns, delimiter='|', fix_quirk=True):
+        self.n_fields = n_fields
+        self.columns = list(columns)
+        self.delimiter = delimiter
+        # todo: the conversion of '|?' to '|' was a quirk of the dataset I was using.
+        # Feel free to remove this if not useful
+        self.fix_quirk = fix_quirk
+
+    def parse(self, line):
+        """
+        the kept fields of line, stripped, or [] if it has fewer than n_fields fields
+        """
+        if self.fix_quirk:
+            line = line.replace(self.delimiter + '?', self.delimiter)
+
+        fields = line.split(self.delimiter, self.n_fields)
+        if len(fields) < self.n_fields:
+            return []
+
+        return [fields[i].strip() for i in self.columns]
+
+    def parse_lines(self, lines):
+        """
+        yields the parsed row of each of lines, as per parse
+        """
+        delimiter, n_fields, columns = self.delimiter, self.n_fields, self.columns
+        if self.fix_quirk:
+            lines = itertools.imap(operator.methodcaller('replace', delimiter + '?', delimiter), lines)
+
+        for line in lines:
+            fields = line.split(delimiter, n_fields)
+            if len(fields) < n_fields:
+                yield []
+            else:
+                yield [fields[i].strip() for i in columns]
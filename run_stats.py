@@ -0,0 +1,161 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Per-file stage timings and reject reason counters for the DiffEngine class in the extract.py module
+
+Every row the engine reads ends up either accepted or rejected for exactly one reason, so for each input file the
+reject counts add up to that file's skipped rows. Counters are plain dict increments and the timings are a pair of
+time.time() calls per stage, so this is cheap enough to leave on. The 'pick' time is also broken down by the checks
+run inside it, so the time going to each rejection stage can be told apart.
+"""
+
+import os
+import json
+import time
+
+from loggers import main_logger
+
+# reasons a row is rejected, in the order the checks run
+REJECT_REASONS = (
+    'misaligned',                # fewer fields than HEADERS
+    'amount_invalid',            # TRANS_amount is not a number
+    'amount_positive',           # TRANS_amount > 0
+    'date',                      # entry_date before 2011
+    'empty_narrative',           # narrative shorter than 2 characters
+    'bad_narrative',             # whole narrative matches re_bad_narratives or re_dead_narratives
+    'short_comparator',          # comparator shorter than 3 characters
+    'excluded_string',           # comparator contains one of the hard coded strings
+    'already_checked',           # comparator seen before
+    'seed_match',                # comparator is a seed item
+    'density_fail',              # too many comparator tokens with unwanted seed density
+    'modified_already_checked',  # modified comparator seen before
+    'modified_seed_match',       # modified comparator is a seed item
+    'coverage_match',            # a seed item is covered by the modified comparator above MATCH_THRESHOLD
+    'near_duplicate',            # modified comparator is a near duplicate of a seed item or accepted row
+    'top_k',                     # top-K mode: less novel than everything held in the top K
+    'top_k_evicted',             # top-K mode: held in the top K, then pushed out by a more novel narrative
+    'top_k_density_fail',        # top-K mode: held in the top K, then failing the density check as the seed moved
+    'shard_conflict',            # sharded mode: accepted by another shard in the same round
+)
+
+# the timed parts of the 'pick' stage, in the order they run. their time counts towards 'pick' as well
+PICK_STAGES = (
+    'easy_checks',     # comparator shorter than 3 characters, excluded strings, already checked or a seed item
+    'density_check',   # seed density of the comparator tokens
+    'coverage_check',  # modified comparator already checked, a seed item, or covering one above MATCH_THRESHOLD
+    'near_duplicate',  # modified comparator a near duplicate of a seed item or accepted row
+    'accept',          # adding an accepted narrative to the seed, or to the top K, and rebuilding the seed stats
+)
+
+# timed stages
+STAGES = ('prefilter', 'regex', 'pick') + PICK_STAGES + ('write', 'file')
+
+UNASSIGNED = '(no file)'
+
+
+class RunStats(object):
+    """
+    counts and timings per input file. start_file() switches the file the following counts are kept against
+    """
+    def __init__(self):
+        self.files = {}
+        self.file_order = []
+        self.current = None
+        self.started = time.time()
+        self.shards = None  # drift report of a sharded run
+        self.stopped_files = None  # files stopped early for low yield - see file_yield.py
+        self.start_file(UNASSIGNED)
+
+    def start_file(self, dat_file):
+        if dat_file not in self.files:
+            self.files[dat_file] = {'rows': 0,
+                                    'accepted': 0,
+                                    'rejected': dict((reason, 0) for reason in REJECT_REASONS),
+                                    'seconds': dict((stage, 0.) for stage in STAGES)}
+            self.file_order.append(dat_file)
+        self.current = self.files[dat_file]
+
+    def end_file(self):
+        self.current = self.files[UNASSIGNED]
+
+    def rows(self, n):
+        self.current['rows'] += n
+
+    def accept(self, n=1):
+        self.current['accepted'] += n
+
+    def reject(self, reason, n=1):
+        self.current['rejected'][reason] += n
+
+    def evict(self, dat_file, reason='top_k_evicted'):
+        # a row accepted earlier, possibly from another file, is rejected after all
+        file_stats = self.files[dat_file]
+        file_stats['accepted'] -= 1
+        file_stats['rejected'][reason] += 1
+
+    def merge(self, other):
+        """
+        adds the counts and timings of other, eg from a shard, into these
+        """
+        for dat_file in other.file_order:
+            other_stats = other.files[dat_file]
+            current = self.current
+            self.start_file(dat_file)
+            file_stats = self.files[dat_file]
+            self.current = current
+
+            file_stats['rows'] += other_stats['rows']
+            file_stats['accepted'] += other_stats['accepted']
+            for reason, n in other_stats['rejected'].iteritems():
+                file_stats['rejected'][reason] += n
+            for stage, seconds in other_stats['seconds'].iteritems():
+                file_stats['seconds'][stage] += seconds
+
+    def add_time(self, stage, seconds):
+        self.current['seconds'][stage] += seconds
+
+    def totals(self):
+        totals = {'rows': 0,
+                  'accepted': 0,
+                  'rejected': dict((reason, 0) for reason in REJECT_REASONS),
+                  'seconds': dict((stage, 0.) for stage in STAGES)}
+
+        for file_stats in self.files.itervalues():
+            totals['rows'] += file_stats['rows']
+            totals['accepted'] += file_stats['accepted']
+            for reason, n in file_stats['rejected'].iteritems():
+                totals['rejected'][reason] += n
+            for stage, seconds in file_stats['seconds'].iteritems():
+                totals['seconds'][stage] += seconds
+
+        return totals
+
+    def to_dict(self):
+        files = [dict(self.files[dat_file], dat_file=dat_file) for dat_file in self.file_order
+                 if dat_file != UNASSIGNED or self.files[UNASSIGNED]['rows'] or self.files[UNASSIGNED]['accepted']]
+
+        stats = {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                 'wall_seconds': time.time() - self.started,
+                 'reject_reasons': list(REJECT_REASONS),
+                 'totals': self.totals(),
+                 'files': files}
+        if self.shards is not None:
+            stats['shards'] = self.shards
+        if self.stopped_files is not None:
+            stats['stopped_files'] = self.stopped_files
+
+        return stats
+
+    def write(self, path):
+        dir_name = os.path.dirname(path)
+        try:
+            if dir_name and not os.path.isdir(dir_name):
+                os.makedirs(dir_name)
+            with open(path, 'w') as fileHandle:
+                json.dump(self.to_dict(), fileHandle, indent=2, sort_keys=True)
+        except (IOError, OSError) as e:
+            main_logger.error('could not write run stats to %s: %s' % (path, e))
+            return False
+
+        main_logger.info('run stats written to %s' % path)
+        return True
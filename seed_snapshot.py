@@ -0,0 +1,90 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Binary snapshot of the compiled seed for the DiffEngine class in the extract.py module
+
+Tokenising the .seed files against re_bad_seed and counting token densities is slow on large seeds. The compiled
+result is pickled next to the seed files, together with the size and mtime of every .seed file it was built from
+and a signature of re_bad_seed, and is only used while all of those still match.
+"""
+
+import os
+import cPickle
+
+from loggers import main_logger
+from rank_cache import pattern_signature
+from regex_filters import re_bad_seed
+
+SEED_SNAPSHOT_FILENAME = 'seed_snapshot.pkl'
+
+# bump this if the layout of the snapshot or the way the seed is compiled changes
+SEED_SNAPSHOT_VERSION = 2
+
+
+def seed_sources(seed_files):
+    """
+    returns [[path, size, mtime], ...] for the seed files, used to tell whether a snapshot is fresh
+    """
+    sources = []
+    for seed_file in seed_files:
+        st = os.stat(seed_file)
+        sources.append([os.path.abspath(seed_file), st.st_size, st.st_mtime])
+
+    return sources
+
+
+def write_seed_snapshot(snapshot_file, seed_files, state):
+    """
+    pickles the compiled seed state
+
+    args:
+        snapshot_file(str): full path of the snapshot to write
+        seed_files(list): the .seed files state was compiled from
+        state(dict): the compiled seed - see DiffEngine.compile_seed()
+    """
+    snapshot = {'version': SEED_SNAPSHOT_VERSION,
+                'signature': pattern_signature(re_bad_seed),
+                'sources': seed_sources(seed_files),
+                'state': state}
+
+    tmp_file = snapshot_file + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as fileHandle:
+            cPickle.dump(snapshot, fileHandle, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, snapshot_file)
+    except (IOError, OSError) as e:
+        main_logger.error('could not write seed snapshot %s: %s' % (snapshot_file, e))
+        return False
+
+    main_logger.info('seed snapshot written to %s' % snapshot_file)
+    return True
+
+
+def load_seed_snapshot(snapshot_file, seed_files):
+    """
+    returns the compiled seed state from snapshot_file, or None if it is missing or stale
+
+    args:
+        snapshot_file(str): full path of the snapshot
+        seed_files(list): the .seed files the snapshot must have been compiled from
+    """
+    try:
+        with open(snapshot_file, 'rb') as fileHandle:
+            snapshot = cPickle.load(fileHandle)
+    except (IOError, EOFError, cPickle.UnpicklingError) as e:
+        main_logger.info('no usable seed snapshot at %s: %s' % (snapshot_file, e))
+        return None
+
+    if snapshot.get('version') != SEED_SNAPSHOT_VERSION:
+        main_logger.info('seed snapshot version changed, loading .seed files')
+        return None
+
+    if snapshot.get('signature') != pattern_signature(re_bad_seed):
+        main_logger.info('re_bad_seed changed since the seed snapshot was compiled, loading .seed files')
+        return None
+
+    if snapshot.get('sources') != seed_sources(seed_files):
+        main_logger.info('.seed files changed since the seed snapshot was compiled, loading .seed files')
+        return None
+
+    return snapshot['state']
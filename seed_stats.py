@@ -0,0 +1,78 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Running statistics over the seed token densities used by the DiffEngine class in the extract.py module
+
+Every accepted narrative changes the density of a handful of tokens. Rather than recomputing the mean, stddev
+and distinct density list over every token on each change, the totals are kept up to date as densities move.
+
+test_seed_stats.py checks the running statistics against a full NumPy recomputation
+"""
+
+import bisect
+import math
+
+
+class SeedDensityStats(object):
+    """
+    Keeps the count, sum and sum of squares of the seed token densities, plus the number of tokens at each
+    distinct density, so the seed statistics can be read back without a pass over every token.
+
+    Densities are integer counts, so the sums are held as exact integers and only converted to float when read.
+    """
+    def __init__(self, densities=()):
+        self.n = 0
+        self.total = 0
+        self.total_sq = 0
+        self.density_counts = {}  # density -> number of tokens with that density
+        self.distinct = []  # distinct densities, ascending
+
+        for d in densities:
+            self.add(d)
+
+    def add(self, density):
+        self.n += 1
+        self.total += density
+        self.total_sq += density * density
+
+        if density in self.density_counts:
+            self.density_counts[density] += 1
+        else:
+            self.density_counts[density] = 1
+            bisect.insort(self.distinct, density)
+
+    def remove(self, density):
+        self.n -= 1
+        self.total -= density
+        self.total_sq -= density * density
+
+        self.density_counts[density] -= 1
+        if self.density_counts[density] == 0:
+            del self.density_counts[density]
+            del self.distinct[bisect.bisect_left(self.distinct, density)]
+
+    def update(self, old_density, new_density):
+        """
+        moves a token from old_density to new_density; an old_density of 0 means the token is new to the seed
+        """
+        if old_density:
+            self.remove(old_density)
+        self.add(new_density)
+
+    def mean(self):
+        if self.n == 0:
+            return float('nan')
+        return float(self.total) / self.n
+
+    def stddev(self):
+        if self.n == 0:
+            return float('nan')
+        # population variance from exact integer sums: (n * sum(x^2) - sum(x)^2) / n^2
+        return math.sqrt(float(self.n * self.total_sq - self.total * self.total)) / self.n
+
+    def densities(self):
+        """
+        distinct densities, highest first - as per sorted(set(seed_density.values()), reverse=True)
+        """
+        return self.distinct[::-1]
+
@@ -0,0 +1,271 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Sharded processing of the ranked files for the DiffEngine class in the extract.py module
+
+The ranked files are dealt round robin to N worker processes. Each worker is forked from the engine, so it starts
+with its own copy of the seed, and runs the usual checks over its files. Workers sync in rounds: after every
+sync_rows input rows each worker sends the narratives it accepted in the round to the coordinator (the parent
+process) and waits for the merge.
+
+The coordinator merges a round in shard order. A narrative already accepted by an earlier shard in the same round is
+dropped as a conflict, as a sequential run would have rejected it as already checked. The rows kept are written
+out, and every worker is sent the narratives kept from the other shards, to add to its seed densities and
+already_checked, plus its own dropped narratives, to take back out. After each round every shard has the same
+seed densities, so over-sampling control holds across shards. Within a round a shard cannot see what the others
+accept, which is where a sharded run can drift from a sequential one.
+
+Rounds depend only on row counts, so for a given number of shards and sync_rows the result is reproducible.
+"""
+
+import time
+import Queue
+import traceback
+import multiprocessing
+
+from loggers import main_logger, after_fork
+from run_stats import RunStats
+
+# input rows each shard processes between syncs
+SHARD_SYNC_ROWS = 5000
+
+# seconds between checks that the workers are still alive while waiting on them
+_POLL_SECONDS = 1
+
+
+def partition(ranked_files, shards):
+    """
+    deals ranked_files round robin, so every shard gets a share of the best ranked files
+
+    returns:
+        list of shards lists of ranked_files entries
+    """
+    return [ranked_files[shard::shards] for shard in xrange(shards)]
+
+
+def run_shard(engine, shard, ranked_files, outbox, inbox, sync_rows):
+    """
+    body of a worker process. engine is the coordinator's engine as it was when the worker was forked
+    """
+    after_fork()
+    try:
+        _run_shard(engine, shard, ranked_files, outbox, inbox, sync_rows)
+    except Exception:
+        outbox.put({'shard': shard, 'error': traceback.format_exc()})
+
+
+def _run_shard(engine, shard, ranked_files, outbox, inbox, sync_rows):
+    engine.run_stats = RunStats()
+    engine.accept_log = []
+    # rounds can only end between blocks
+    engine.prefilter_chunk_size = min(engine.prefilter_chunk_size, sync_rows)
+
+    pending = {'rows': [], 'files': [], 'processed': engine.processed_rows, 'skipped': engine.skipped_rows}
+
+    def sync(done):
+        message = {'shard': shard,
+                   'rows': pending['rows'],
+                   'files': pending['files'],
+                   'processed': engine.processed_rows - pending['processed'],
+                   'skipped': engine.skipped_rows - pending['skipped'],
+                   'done': done,
+                   'run_stats': engine.run_stats if done else None}
+        outbox.put(message)
+
+        pending.update(rows=[], files=[], processed=engine.processed_rows, skipped=engine.skipped_rows)
+        if not done:
+            apply_merge(engine, inbox.get())
+
+    rows_since_sync = 0
+    for ranked_entry in ranked_files:
+        dat_file = ranked_entry['dat_file']
+        engine.current_dat_file = dat_file
+        engine.run_stats.start_file(dat_file)
+        pending['files'].append(dat_file)
+        file_start = time.time()
+
+        for block_rows, accepted in engine.iter_filtered_blocks(dat_file):
+            # accept_log holds (comparator, modified_comparator) for each accepted row, in the same order
+            pending['rows'].extend((dat_file, row, comparator, modified_comparator)
+                                   for row, (comparator, modified_comparator) in zip(accepted, engine.accept_log))
+            del engine.accept_log[:]
+
+            rows_since_sync += block_rows
+            if rows_since_sync >= sync_rows:
+                sync(False)
+                rows_since_sync = 0
+
+        engine.run_stats.add_time('file', time.time() - file_start)
+        engine.run_stats.end_file()
+
+    sync(True)
+
+
+def apply_merge(engine, merge):
+    """
+    brings a worker's seed in line with the coordinator's after a round
+    """
+    for modified_comparator in merge['dropped']:
+        for mc in modified_comparator:
+            engine.decrement_seed_density(mc)
+
+    for comparator, modified_comparator in merge['others']:
+        engine.record_accepted(comparator, modified_comparator)
+
+    engine.build_seed_stats()
+
+
+class ShardCoordinator(object):
+    """
+    runs engine's ranked files in shards worker processes and merges their rounds into engine, writing the kept
+    rows to engine.writer
+
+    args:
+        engine(DiffEngine): the coordinating engine
+        shards(int): number of worker processes
+        sync_rows(int): input rows each shard processes between syncs
+        keep_accepted(bool): collect the kept comparators in self.accepted, eg to compare with a sequential run
+    """
+    def __init__(self, engine, shards, sync_rows=SHARD_SYNC_ROWS, keep_accepted=False):
+        self.engine = engine
+        self.shards = shards
+        self.sync_rows = sync_rows
+        self.accepted = set() if keep_accepted else None
+
+        self.rounds = 0
+        self.kept = 0
+        self.conflicts = []  # dat_file of each dropped row
+        self.stale_rows = 0
+
+    def run(self):
+        engine = self.engine
+        outbox = multiprocessing.Queue()
+        inboxes = [multiprocessing.Queue() for _ in xrange(self.shards)]
+        processes = []
+
+        for shard, ranked_files in enumerate(partition(engine.ranked_files, self.shards)):
+            process = multiprocessing.Process(target=run_shard, name='shard%s' % shard,
+                                              args=(engine, shard, ranked_files, outbox, inboxes[shard],
+                                                    self.sync_rows))
+            process.daemon = True
+            process.start()
+            processes.append(process)
+        main_logger.info('started %s shards, syncing every %s rows' % (self.shards, self.sync_rows))
+
+        active = set(xrange(self.shards))
+        try:
+            while active:
+                messages = self._collect(outbox, processes, active)
+                merges = self.merge_round(messages)
+
+                for message in messages:
+                    if message['done']:
+                        active.discard(message['shard'])
+                        engine.run_stats.merge(message['run_stats'])
+                    else:
+                        inboxes[message['shard']].put(merges[message['shard']])
+        finally:
+            for process in processes:
+                if process.is_alive() and active:
+                    process.terminate()
+                process.join()
+
+        for dat_file in self.conflicts:
+            engine.run_stats.evict(dat_file, 'shard_conflict')
+
+    def _collect(self, outbox, processes, active):
+        # one message from each active shard, in shard order
+        messages = {}
+        while len(messages) < len(active):
+            try:
+                message = outbox.get(timeout=_POLL_SECONDS)
+            except Queue.Empty:
+                for shard in active:
+                    if shard not in messages and not processes[shard].is_alive():
+                        raise RuntimeError('shard %s exited with code %s' % (shard, processes[shard].exitcode))
+                continue
+
+            if 'error' in message:
+                raise RuntimeError('shard %s failed:\n%s' % (message['shard'], message['error']))
+            messages[message['shard']] = message
+
+        return [messages[shard] for shard in sorted(messages)]
+
+    def merge_round(self, messages):
+        """
+        applies one round of shard messages to the engine and writes the rows kept
+
+        returns:
+            {shard: {'dropped': [...], 'others': [...]}} to send back to each shard
+        """
+        engine = self.engine
+        self.rounds += 1
+
+        kept = []  # (shard, comparator, modified_comparator)
+        dropped = dict((message['shard'], []) for message in messages)
+        token_shards = {}  # token -> shards keeping a row with it this round
+
+        for message in messages:
+            shard = message['shard']
+            engine.processed_rows += message['processed']
+            engine.skipped_rows += message['skipped']
+
+            for dat_file in message['files']:
+                engine.set_outfile()  # one outfile rotation check per input file, as in a sequential run
+
+            rows = []
+            for dat_file, row, comparator, modified_comparator in message['rows']:
+                if comparator in engine.already_checked or ' '.join(modified_comparator) in engine.already_checked:
+                    # accepted by an earlier shard in this round
+                    dropped[shard].append(modified_comparator)
+                    self.conflicts.append(dat_file)
+                    engine.skipped_rows += 1
+                    continue
+
+                engine.record_accepted(comparator, modified_comparator)
+                kept.append((shard, comparator, modified_comparator))
+                rows.append(row)
+                for mc in modified_comparator:
+                    token_shards.setdefault(mc, set()).add(shard)
+                if self.accepted is not None:
+                    self.accepted.add(comparator)
+
+            engine.writer.write_rows(rows)
+
+        engine.build_seed_stats()
+        self.kept += len(kept)
+
+        # rows sharing a token with a row kept by another shard in the same round were checked on stale densities
+        for shard, comparator, modified_comparator in kept:
+            if any(len(token_shards[mc]) > 1 for mc in modified_comparator):
+                self.stale_rows += 1
+
+        return dict((shard, {'dropped': dropped[shard],
+                             'others': [(c, mc) for s, c, mc in kept if s != shard]}) for shard in dropped)
+
+    def report(self):
+        """
+        how far the sharded run may have drifted from a sequential one
+        """
+        return {'shards': self.shards,
+                'sync_rows': self.sync_rows,
+                'rounds': self.rounds,
+                'accepted': self.kept,
+                'conflicts': len(self.conflicts),
+                'stale_rows': self.stale_rows,
+                'stale_fraction': float(self.stale_rows) / self.kept if self.kept else 0.}
+
+
+def compare_accepted(sharded, sequential):
+    """
+    compares the comparators accepted by a sharded run with those of a sequential run over the same files
+    """
+    common = len(sharded & sequential)
+    union = len(sharded | sequential)
+
+    return {'sequential_accepted': len(sequential),
+            'sharded_accepted': len(sharded),
+            'common': common,
+            'only_sharded': len(sharded) - common,
+            'only_sequential': len(sequential) - common,
+            'jaccard': float(common) / union if union else 1.}
@@ -0,0 +1,71 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Checks SeedDensityStats in the seed_stats.py module against a full NumPy recomputation over the same densities
+
+Run with python -m unittest test_seed_stats (or pytest)
+"""
+
+import random
+import unittest
+
+import numpy as np
+
+from seed_stats import SeedDensityStats
+
+
+class SeedDensityStatsTest(unittest.TestCase):
+
+    def assertMatches(self, stats, seed_density):
+        values = seed_density.values()
+        self.assertEqual(stats.n, len(values))
+        self.assertTrue(np.isclose(stats.mean(), np.average(values), rtol=1e-12, atol=0))
+        self.assertTrue(np.isclose(stats.stddev(), np.std(values), rtol=1e-9, atol=1e-12))
+        self.assertEqual(stats.densities(), sorted(set(values), reverse=True))
+
+    def test_increments_match_numpy(self):
+        rnd = random.Random(0)
+        seed_density = {}
+        stats = SeedDensityStats()
+
+        for step in xrange(20000):
+            token = 'tok%s' % rnd.randint(0, 2000)
+            old = seed_density.get(token, 0)
+            seed_density[token] = old + rnd.randint(1, 3)
+            stats.update(old, seed_density[token])
+
+            if step % 1000 == 0:
+                self.assertMatches(stats, seed_density)
+
+        self.assertMatches(stats, seed_density)
+
+    def test_decrements_and_removals_match_numpy(self):
+        rnd = random.Random(1)
+        seed_density = dict(('tok%s' % i, rnd.randint(1, 5)) for i in xrange(500))
+        stats = SeedDensityStats(seed_density.values())
+        self.assertMatches(stats, seed_density)
+
+        for step in xrange(1000):
+            token = rnd.choice(sorted(seed_density))
+            old = seed_density[token]
+            if old == 1:
+                del seed_density[token]
+                stats.remove(old)
+            else:
+                seed_density[token] = old - 1
+                stats.update(old, old - 1)
+
+            if step % 100 == 0:
+                self.assertMatches(stats, seed_density)
+
+        self.assertMatches(stats, seed_density)
+
+    def test_empty(self):
+        stats = SeedDensityStats()
+        self.assertTrue(np.isnan(stats.mean()))
+        self.assertTrue(np.isnan(stats.stddev()))
+        self.assertEqual(stats.densities(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Size-bounded memo of token classifications for the DiffEngine class in the extract.py module
+
+Transaction narratives reuse a small vocabulary heavily, so the same tokens are matched against the
+regex_filters patterns over and over. Each token's result is kept in a plain dict, so a hit is a single dict
+lookup. The dict is cleared once it holds max_size tokens rather than kept in recency order, which would cost as
+much per hit as the regexes it saves; the tokens in use are back in it after a few narratives.
+"""
+
+import collections
+
+from regex_filters import re_bad_seed, re_bad_narratives, re_dead_narratives
+
+# default number of tokens kept in the cache
+TOKEN_CACHE_SIZE = 100000
+
+# (bad_seed, bad_narrative, dead_narrative) - whether the token matches re_bad_seed, re_bad_narratives
+# and re_dead_narratives respectively
+TokenClass = collections.namedtuple('TokenClass', 'bad_seed bad_narrative dead_narrative')
+
+
+class TokenClassCache(object):
+    """
+    cache of token -> TokenClass, holding at most max_size tokens
+
+    hits, misses and evictions are counted so the cache can be sized from the run logs: evictions is the number of
+    tokens dropped when the cache was cleared, clears the number of times it was
+    """
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        if max_size < 1:
+            raise ValueError('token cache size must be at least 1, got %s' % max_size)
+        self.max_size = max_size
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clears = 0
+
+    def classify(self, token):
+        token_class = self.cache.get(token)
+        if token_class is not None:
+            self.hits += 1
+            return token_class
+
+        self.misses += 1
+        token_class = TokenClass(re_bad_seed.match(token) is not None,
+                                 re_bad_narratives.match(token) is not None,
+                                 re_dead_narratives.match(token) is not None)
+        if len(self.cache) >= self.max_size:
+            self.evictions += len(self.cache)
+            self.clears += 1
+            self.cache.clear()
+
+        self.cache[token] = token_class
+        return token_class
+
+    def stats(self):
+        return {'size': len(self.cache), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'clears': self.clears}
@@ -0,0 +1,254 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Integer token ids for the seed densities and seed coverage checks of the DiffEngine class in the extract.py module
+
+Every token the seed knows about is given an integer id by a TokenDictionary. With the ids:
+    - TokenDensities holds the seed densities in a growable NumPy array indexed by token id, behind the dict
+      methods the engine and its helpers use, and reads the densities of a whole comparator in one gather
+    - SeedIndex holds the seed items as one flat array of token ids, plus posting lists from each token id to the
+      items holding it. the coverage of every seed item sharing a token with a comparator is counted in a few
+      array operations, instead of splitting each seed item and testing its tokens against the comparator one by one
+
+Id 0 stands for the empty token and for any token not in the dictionary; it never has a density or a posting list.
+"""
+
+import array
+import itertools
+
+import numpy as np
+
+# tokens from which TokenDensities.lookup gathers with one take rather than reading the array per token
+GATHER_TOKENS = 16
+
+# candidate postings up to which SeedIndex.coverage counts in python rather than with np.unique, which has a higher
+# fixed cost
+SMALL_POSTINGS = 64
+
+
+class TokenDictionary(object):
+    """
+    token -> integer id, and back. ids are handed out from 1 in the order tokens are added and never change
+    """
+    def __init__(self):
+        self.ids = {}
+        self.tokens = ['']  # id -> token; id 0 is the empty / unknown token
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, token):
+        """
+        returns the id of token, giving it the next free id if it is new
+        """
+        if not token:
+            return 0
+
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+
+        return token_id
+
+    def get(self, token):
+        """
+        returns the id of token, or 0 if it is not in the dictionary
+        """
+        return self.ids.get(token, 0)
+
+    def lookup(self, tokens):
+        ids = self.ids
+        return [ids.get(token, 0) for token in tokens]
+
+    def decode(self, token_ids):
+        tokens = self.tokens
+        return ' '.join(tokens[token_id] for token_id in token_ids)
+
+
+class TokenDensities(object):
+    """
+    seed density of each token, held in a NumPy array indexed by token id which grows as tokens are added.
+
+    behaves as the token -> density dict it replaces: tokens with a density of 0 are not in it, and get, items,
+    iteritems, itervalues and len only see tokens with a density
+    """
+    def __init__(self, dictionary, counts=()):
+        self.dictionary = dictionary
+        self.array = np.zeros(max(16, len(dictionary)), dtype=np.int64)
+        self.n = 0  # tokens with a density
+
+        for token, density in counts:
+            self[token] = density
+
+    def _grow(self, size):
+        array = np.zeros(max(size, 2 * len(self.array)), dtype=np.int64)
+        array[:len(self.array)] = self.array
+        self.array = array
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, token):
+        return self.get(token, 0) > 0
+
+    def __getitem__(self, token):
+        density = self.get(token, 0)
+        if not density:
+            raise KeyError(token)
+        return density
+
+    def __setitem__(self, token, density):
+        token_id = self.dictionary.add(token)
+        if token_id == 0:
+            raise KeyError(token)
+        if token_id >= len(self.array):
+            self._grow(token_id + 1)
+
+        self.n += int(density > 0) - int(self.array[token_id] > 0)
+        self.array[token_id] = density
+
+    def __delitem__(self, token):
+        if token not in self:
+            raise KeyError(token)
+        self[token] = 0
+
+    def get(self, token, default=None):
+        token_id = self.dictionary.ids.get(token, 0)
+        if token_id == 0 or token_id >= len(self.array):
+            return default
+
+        density = self.array.item(token_id)
+        return density if density else default
+
+    def lookup(self, tokens):
+        """
+        returns the densities of tokens as a list of ints, 0 for tokens without a density
+        """
+        if len(self.dictionary) > len(self.array):
+            self._grow(len(self.dictionary))  # tokens added to the dictionary by a SeedIndex
+
+        ids = self.dictionary.ids
+        if len(tokens) >= GATHER_TOKENS:
+            return self.array.take([ids.get(token, 0) for token in tokens]).tolist()
+
+        item = self.array.item  # returns python ints, and is quicker than a take on a few tokens
+        return [item(ids.get(token, 0)) for token in tokens]
+
+    def iteritems(self):
+        token_ids = np.flatnonzero(self.array)
+        tokens = self.dictionary.tokens
+        for token_id, density in itertools.izip(token_ids.tolist(), self.array[token_ids].tolist()):
+            yield tokens[token_id], density
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        return iter(self.array[self.array > 0].tolist())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def keys(self):
+        return [token for token, density in self.iteritems()]
+
+    def nbytes(self):
+        return self.array.nbytes
+
+
+def _as_numpy(values, dtype):
+    # values(array.array) as a new numpy array of dtype
+    if not values:
+        return np.zeros(0, dtype=dtype)
+    return np.frombuffer(values, dtype=np.dtype(values.typecode)).astype(dtype)
+
+
+class SeedIndex(object):
+    """
+    the seed items as token ids, with posting lists from token id to item ids
+
+    args:
+        items(iterable): token ids of each seed item, as per TokenDictionary.add over item.strip().split(' '). empty
+                     tokens are 0 and count towards the length of their item, as they always have
+    """
+    def __init__(self, items):
+        # read one item at a time, so only the flat arrays are ever held
+        flat_tokens = array.array('i')
+        flat_lengths = array.array('l')
+        for item in items:
+            flat_tokens.extend(item)
+            flat_lengths.append(len(item))
+
+        # the buffers are read with the numpy type of their own typecode, as the size of a C int / long depends on
+        # the platform (a long is 4 bytes on windows), then converted to fixed sizes
+        self.item_tokens = _as_numpy(flat_tokens, np.int32)
+        lengths = _as_numpy(flat_lengths, np.int64)
+        del flat_tokens, flat_lengths
+
+        self.item_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.item_offsets[1:])
+        self.lengths = lengths.astype(np.float64)
+        self._lengths = lengths.tolist()
+
+        # an item holding a token twice is posted twice, so counting postings counts token occurrences
+        owners = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+        indexed = self.item_tokens > 0
+        tokens = self.item_tokens[indexed]
+        order = np.argsort(tokens, kind='mergesort')  # stable, so each posting list is in item order
+        self.postings = owners[indexed][order]
+
+        counts = np.bincount(tokens, minlength=1) if len(tokens) else np.zeros(1, dtype=np.int64)
+        self.posting_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.posting_offsets[1:])
+        self._posting_starts = self.posting_offsets.tolist()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def nbytes(self):
+        return self.item_offsets.nbytes + self.item_tokens.nbytes + self.postings.nbytes + self.posting_offsets.nbytes
+
+    def item(self, item_id):
+        """
+        token ids of a seed item
+        """
+        return self.item_tokens[self.item_offsets[item_id]:self.item_offsets[item_id + 1]].tolist()
+
+    def coverage(self, token_ids):
+        """
+        the share of each seed item's tokens found among token_ids, for the seed item where it is highest.
+        items sharing no token with token_ids have a coverage of 0
+
+        args:
+            token_ids(set): distinct token ids of a comparator
+
+        returns:
+            (item id, coverage), or (None, 0.) if no seed item shares a token
+        """
+        starts = self._posting_starts
+        last = len(starts) - 1
+        spans = [(starts[t], starts[t + 1]) for t in token_ids if 0 < t < last and starts[t] < starts[t + 1]]
+        if not spans:
+            return None, 0.
+
+        if sum(end - start for start, end in spans) <= SMALL_POSTINGS:
+            hits = {}
+            for start, end in spans:
+                for item_id in self.postings[start:end].tolist():
+                    hits[item_id] = hits.get(item_id, 0) + 1
+
+            lengths = self._lengths
+            best_item, best = None, -1.
+            for item_id in sorted(hits):
+                coverage = float(hits[item_id]) / lengths[item_id]
+                if coverage > best:
+                    best_item, best = item_id, coverage
+            return best_item, best
+
+        postings = np.concatenate([self.postings[start:end] for start, end in spans])
+        item_ids, counts = np.unique(postings, return_counts=True)
+        coverage = counts / self.lengths[item_ids]
+        best = int(coverage.argmax())
+
+        return int(item_ids[best]), float(coverage[best])
@@ -0,0 +1,140 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Top-K selection of the most novel narratives for the DiffEngine class in the extract.py module
+
+By default the engine accepts greedily: the first narrative to pass the checks wins, so what is accepted depends on
+the order of the files. In top-K mode every narrative passing the checks is scored on its novelty against the seed
+statistics and offered to a min-heap holding the best K so far; a better candidate pushes out the worst one. Only
+the heap holds rows, so the candidates take O(K) memory however much input is streamed through. already_checked and
+density_fail still take in every distinct narrative checked, as in greedy mode; --membership hash makes them smaller
+and --membership bloom bounds them.
+
+Narratives held by the heap count towards the seed densities, as accepted narratives do in greedy mode, and leave
+them again when evicted. As the seed moves, the narratives already held go stale, so after each file the engine
+re-runs the density check on them, evicting those which now fail it, and re-scores the rest - see
+DiffEngine.rescore_top_k and TopKHeap.rescore.
+"""
+
+import heapq
+
+
+def novelty_score(tokens, seed_density, coverage, own_counts=None):
+    """
+    novelty of a narrative against the seed: the mean of 1 / (1 + seed density) over its tokens, scaled down by how
+    much of the closest seed item it covers. 1. is a narrative made of tokens new to the seed
+
+    args:
+        tokens(list): the modified comparator
+        seed_density(dict): token -> density
+        coverage(float): highest coverage of a seed item by the narrative - see token_ids.SeedIndex.coverage
+        own_counts(dict): token -> count this narrative itself has added to seed_density, if any
+    """
+    if not tokens:
+        return 0.
+
+    total = 0.
+    for token in tokens:
+        density = seed_density.get(token, 0)
+        if own_counts:
+            density -= own_counts.get(token, 0)
+        total += 1. / (1 + density)
+
+    return (1. - coverage) * total / len(tokens)
+
+
+class TopKEntry(object):
+    """
+    a narrative held by TopKHeap
+
+    args:
+        row(list): output row, in OUT_HEADERS order
+        tokens(list): modified comparator
+        coverage(float): as per novelty_score
+        dat_file(str): input file the row came from
+    """
+    __slots__ = ('row', 'tokens', 'coverage', 'dat_file')
+
+    def __init__(self, row, tokens, coverage, dat_file):
+        self.row = row
+        self.tokens = tokens
+        self.coverage = coverage
+        self.dat_file = dat_file
+
+    def token_counts(self):
+        counts = {}
+        for token in self.tokens:
+            counts[token] = counts.get(token, 0) + 1
+        return counts
+
+    def __getstate__(self):
+        return self.row, self.tokens, self.coverage, self.dat_file
+
+    def __setstate__(self, state):
+        self.row, self.tokens, self.coverage, self.dat_file = state
+
+
+class TopKHeap(object):
+    """
+    min-heap of the k best scoring entries. the root is the entry to evict next: the lowest score and, between
+    equal scores, the one offered last - so earlier rows win ties, as they do in greedy mode
+    """
+    def __init__(self, k):
+        self.k = k
+        self.heap = []  # [score, -sequence, entry]
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def admits(self, score):
+        """
+        whether an entry with score would be kept
+        """
+        return len(self.heap) < self.k or score > self.heap[0][0]
+
+    def push(self, score, entry):
+        """
+        adds entry, which has to pass admits(score)
+
+        returns:
+            evicted(TopKEntry): the entry pushed out to make room, or None
+        """
+        self.sequence += 1
+        item = [score, -self.sequence, entry]
+
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+            return None
+
+        return heapq.heapreplace(self.heap, item)[2]
+
+    def remove(self, entries):
+        """
+        takes entries out of the heap
+        """
+        removed = set(id(entry) for entry in entries)
+        self.heap = [item for item in self.heap if id(item[2]) not in removed]
+        heapq.heapify(self.heap)
+
+    def rescore(self, score_func):
+        """
+        re-scores every entry with score_func(entry) and restores the heap order
+        """
+        for item in self.heap:
+            item[0] = score_func(item[2])
+        heapq.heapify(self.heap)
+
+    def entries(self):
+        """
+        entries best first
+        """
+        return [item[2] for item in sorted(self.heap, reverse=True)]
+
+    def drain(self):
+        """
+        returns the entries best first and empties the heap
+        """
+        entries = self.entries()
+        self.heap = []
+        return entries
@@ -0,0 +1,60 @@
+__author__ = 'Ammar Akhtar'
+
+"""
+Polling watcher over the data file drop directory, for the watch mode of the DiffEngine class in extract.py
+
+Each poll globs the data file pattern, compressed versions included, as rank_files does. A new file is only handed
+over once its size and modification time are the same on two polls in a row, so a file still being copied in is not
+read half written. Every path is handed over once: a file rewritten after it was processed is not read again.
+"""
+
+import os
+
+from loggers import main_logger
+from compressed_input import glob_data_files
+
+# defaults: seconds between polls of the drop directory, and between flushes of the engine state to the checkpoint
+WATCH_POLL_SECONDS = 5
+WATCH_FLUSH_SECONDS = 300
+
+
+class DirectoryWatcher(object):
+    """
+    args:
+        pattern(str): glob of the data files, eg DiffEngine.data_file_path
+        seen(iterable): files already processed, or queued, which are never handed over
+    """
+    def __init__(self, pattern, seen=()):
+        self.pattern = pattern
+        self.seen = set(seen)
+        self.pending = {}  # path -> (size, mtime) at the last poll, for new files not yet handed over
+
+    def poll(self):
+        """
+        returns:
+            list of the new files which have not changed since the last poll, in glob order
+        """
+        ready = []
+        pending = {}
+
+        for path in glob_data_files(self.pattern):
+            if path in self.seen:
+                continue
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed since the glob
+
+            stamp = (st.st_size, st.st_mtime)
+            if self.pending.get(path) == stamp:
+                ready.append(path)
+                self.seen.add(path)
+            else:
+                pending[path] = stamp
+
+        if ready:
+            main_logger.info('%s new data file(s): %s' % (len(ready), ', '.join(ready)))
+        self.pending = pending
+
+        return ready